@@ -0,0 +1,107 @@
+import argparse
+import hashlib
+import json
+import random
+import time
+
+import redis
+
+from bounded_cache import POLICIES, BoundedCache
+
+# -----------------------------
+# Replays a query log against BoundedCache and reports the hit rate each
+# eviction policy reaches within each memory budget. Misses store a
+# synthetic answer instead of calling the LLM.
+#
+# python benchmark_cache.py --log queries.jsonl --budgets 1MB,4MB,16MB
+# python benchmark_cache.py --queries 50000 --distinct 10000   (Zipf-distributed log)
+# -----------------------------
+
+WORDS = (
+    "the playbook task module host inventory variable role handler template file service "
+    "package user group become check mode loop when register debug copy shell command"
+).split()
+
+
+def parse_size(text):
+    units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+    for unit, factor in units.items():
+        if text.upper().endswith(unit):
+            return int(float(text[:-2]) * factor)
+    return int(text)
+
+
+def load_log(path):
+    # one prompt per line, or JSONL with a "prompt" / "query" field
+    prompts = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                line = record.get("prompt") or record["query"]
+            prompts.append(line)
+    return prompts
+
+
+def zipf_log(queries, distinct, exponent, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / (rank ** exponent) for rank in range(1, distinct + 1)]
+    return [f"question {rank}" for rank in rng.choices(range(distinct), weights=weights, k=queries)]
+
+
+def synthetic_answer(prompt):
+    # same prompt, same answer; lengths spread like real answers (~150 to ~4000 chars)
+    rng = random.Random(prompt)
+    length = int(min(max(rng.lognormvariate(6.5, 0.8), 150), 4000))
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)
+
+
+def replay(r, prompts, policy, budget, compress_over):
+    prefix = f"bench:{policy}:{budget}"
+    cache = BoundedCache(r, prefix=prefix, max_bytes=budget, policy=policy, compress_over=compress_over)
+    cache.clear()
+
+    hits = 0
+    started = time.perf_counter()
+    for prompt in prompts:
+        key = f"{prefix}:{hashlib.sha256(prompt.encode()).hexdigest()}"
+        if cache.get(key) is not None:
+            hits += 1
+        else:
+            cache.put(key, synthetic_answer(prompt))
+    elapsed = time.perf_counter() - started
+
+    stats = cache.stats()
+    cache.clear()
+    return hits / len(prompts), stats, elapsed / len(prompts) * 1000
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Hit rate vs memory per eviction policy")
+    parser.add_argument("--log", help="query log, one prompt per line or JSONL")
+    parser.add_argument("--queries", type=int, default=20000, help="synthetic log length")
+    parser.add_argument("--distinct", type=int, default=5000, help="distinct prompts in the synthetic log")
+    parser.add_argument("--zipf", type=float, default=1.0, help="skew of the synthetic log")
+    parser.add_argument("--budgets", default="256KB,1MB,4MB")
+    parser.add_argument("--compress-over", type=int, default=1024)
+    args = parser.parse_args()
+
+    prompts = load_log(args.log) if args.log else zipf_log(args.queries, args.distinct, args.zipf)
+    ceiling = 1 - len(set(prompts)) / len(prompts)
+    print(f"{len(prompts)} queries, {len(set(prompts))} distinct, best possible hit rate {ceiling:.3f}\n")
+
+    r = redis.Redis(host="localhost", port=6379)
+
+    print(f"{'policy':<6} {'budget':>10} {'hit rate':>9} {'entries':>8} {'stored':>10} {'evictions':>10} {'ms/query':>9}")
+    for budget in map(parse_size, args.budgets.split(",")):
+        for policy in POLICIES:
+            hit_rate, stats, ms = replay(r, prompts, policy, budget, args.compress_over)
+            print(f"{policy:<6} {budget:>10} {hit_rate:>9.3f} {stats['entries']:>8} "
+                  f"{stats['bytes']:>10} {stats.get('evictions', 0):>10} {ms:>9.2f}")
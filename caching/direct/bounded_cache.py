@@ -0,0 +1,204 @@
+import time
+import zlib
+
+# -----------------------------
+# Bounded answer cache in Redis
+# -----------------------------
+# Every entry has a TTL, and the total size of the stored values is kept
+# under max_bytes by evicting the least recently (lru) or least frequently
+# (lfu) used entries. Values above compress_over bytes are zlib-compressed
+# (level 1 - fast, and answers are plain text that compresses ~3x).
+#
+# Keys, for prefix "direct":
+#   direct:{hash}        the value, b"z" + compressed or b"r" + raw utf-8
+#   direct:meta:size     hash   entry -> stored bytes
+#   direct:meta:lru      zset   entry -> last access time
+#   direct:meta:lfu      zset   entry -> number of hits
+#   direct:meta:expiry   zset   entry -> expiry time
+#   direct:meta:bytes    total stored bytes
+#   direct:meta:stats    hash   hits / misses / evictions / too_large
+#
+# Reads and writes are Lua scripts, so metadata never drifts from the
+# entries. Not for Redis Cluster: victims are chosen inside the script.
+
+POLICIES = ("lru", "lfu")
+
+# shared by both scripts: remove one entry and its metadata
+REMOVE = """
+local function remove(entry)
+    local size = redis.call("HGET", KEYS[2], entry)
+    if size then
+        redis.call("DECRBY", KEYS[6], size)
+    end
+    redis.call("HDEL", KEYS[2], entry)
+    redis.call("ZREM", KEYS[3], entry)
+    redis.call("ZREM", KEYS[4], entry)
+    redis.call("ZREM", KEYS[5], entry)
+    redis.call("DEL", entry)
+end
+"""
+
+# KEYS: entry, size, lru, lfu, expiry, bytes, stats   ARGV: now
+GET_SCRIPT = REMOVE + """
+local value = redis.call("GET", KEYS[1])
+if not value then
+    -- expired by Redis: drop its metadata too
+    if redis.call("HEXISTS", KEYS[2], KEYS[1]) == 1 then
+        remove(KEYS[1])
+    end
+    redis.call("HINCRBY", KEYS[7], "misses", 1)
+    return false
+end
+redis.call("ZADD", KEYS[3], ARGV[1], KEYS[1])
+redis.call("ZINCRBY", KEYS[4], 1, KEYS[1])
+redis.call("HINCRBY", KEYS[7], "hits", 1)
+return value
+"""
+
+# KEYS: entry, size, lru, lfu, expiry, bytes, stats   ARGV: value, ttl, now, max_bytes, policy
+PUT_SCRIPT = REMOVE + """
+local now = tonumber(ARGV[3])
+remove(KEYS[1])
+
+-- a value over the whole budget would evict everything else and still not fit
+local size = string.len(ARGV[1])
+if size > tonumber(ARGV[4]) then
+    redis.call("HINCRBY", KEYS[7], "too_large", 1)
+    return 0
+end
+
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+redis.call("HSET", KEYS[2], KEYS[1], size)
+redis.call("INCRBY", KEYS[6], size)
+redis.call("ZADD", KEYS[3], now, KEYS[1])
+redis.call("ZADD", KEYS[4], 0, KEYS[1])
+redis.call("ZADD", KEYS[5], now + tonumber(ARGV[2]), KEYS[1])
+
+-- expired entries first, then by policy until the budget fits
+for _, entry in ipairs(redis.call("ZRANGEBYSCORE", KEYS[5], "-inf", now, "LIMIT", 0, 100)) do
+    remove(entry)
+end
+
+local order = ARGV[5] == "lfu" and KEYS[4] or KEYS[3]
+local evicted = 0
+while tonumber(redis.call("GET", KEYS[6]) or 0) > tonumber(ARGV[4]) do
+    -- never the entry just written (it would always be the lfu victim); it fits
+    -- max_bytes on its own, so while over budget some other entry is left
+    local candidates = redis.call("ZRANGE", order, 0, 1)
+    local victim = candidates[1] == KEYS[1] and candidates[2] or candidates[1]
+    if not victim then
+        break
+    end
+    remove(victim)
+    evicted = evicted + 1
+end
+if evicted > 0 then
+    redis.call("HINCRBY", KEYS[7], "evictions", evicted)
+end
+return evicted
+"""
+
+
+# KEYS: size, lru, lfu   ARGV: now, entry, hits, entry, hits, ...
+# hits served from a faster tier in front of this cache, so they count for eviction too
+TOUCH_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    if redis.call("HEXISTS", KEYS[1], ARGV[i]) == 1 then
+        redis.call("ZADD", KEYS[2], ARGV[1], ARGV[i])
+        redis.call("ZINCRBY", KEYS[3], ARGV[i + 1], ARGV[i])
+    end
+end
+return 0
+"""
+
+
+def encode(value: str, compress_over: int) -> bytes:
+    raw = value.encode()
+    if len(raw) > compress_over:
+        return b"z" + zlib.compress(raw, 1)
+    return b"r" + raw
+
+
+def decode(stored: bytes) -> str:
+    if stored[:1] == b"z":
+        return zlib.decompress(stored[1:]).decode()
+    if stored[:1] == b"r":
+        return stored[1:].decode()
+    # not written by BoundedCache (e.g. an older plain-text answer): as is
+    return stored.decode()
+
+
+class BoundedCache:
+    """
+    get(key) / put(key, value) for string values, key being the entry name
+    (e.g. make_key(prompt)). The Redis client must not decode responses.
+    Entry names should start with the prefix, so they don't collide with
+    plain-text keys of other caches on the same Redis.
+    """
+
+    def __init__(self, redis_client, prefix="direct", ttl=7 * 24 * 3600, max_bytes=256 * 1024 * 1024,
+                 policy="lru", compress_over=1024):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+
+        self.r = redis_client
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.compress_over = compress_over
+        self.meta = [f"{prefix}:meta:{name}" for name in ("size", "lru", "lfu", "expiry", "bytes", "stats")]
+
+        self.get_script = redis_client.register_script(GET_SCRIPT)
+        self.put_script = redis_client.register_script(PUT_SCRIPT)
+        self.touch_script = redis_client.register_script(TOUCH_SCRIPT)
+
+    def get(self, key):
+        stored = self.get_script(keys=[key, *self.meta], args=[time.time()])
+        return None if stored is None else decode(stored)
+
+    def put(self, key, value, ttl=None):
+        """
+        Returns the number of entries evicted to make room. A value larger
+        than max_bytes is not stored (counted as too_large), and an older
+        value under the same key is dropped.
+        """
+        return self.put_script(
+            keys=[key, *self.meta],
+            args=[encode(value, self.compress_over), ttl or self.ttl, time.time(), self.max_bytes, self.policy]
+        )
+
+    def touch(self, hits: dict):
+        """
+        Marks entries as used {key: hits} without reading them, e.g. for
+        hits a local cache in front of this one answered. Evicted entries
+        are skipped.
+        """
+        if not hits:
+            return
+        size, lru, lfu, *_ = self.meta
+        args = [time.time()]
+        for key, count in hits.items():
+            args += [key, count]
+        self.touch_script(keys=[size, lru, lfu], args=args)
+
+    def stats(self):
+        size, _, _, _, total, stats = self.meta
+        pipe = self.r.pipeline(transaction=False)
+        pipe.hlen(size)
+        pipe.get(total)
+        pipe.hgetall(stats)
+        entries, stored, counters = pipe.execute()
+
+        return {
+            "entries": entries,
+            "bytes": int(stored or 0),
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            **{name.decode(): int(count) for name, count in counters.items()}
+        }
+
+    def clear(self):
+        entries = self.r.hkeys(self.meta[0])
+        if entries:
+            self.r.delete(*entries)
+        self.r.delete(*self.meta)
@@ -2,12 +2,26 @@ import hashlib
 import redis
 from openai import OpenAI
 
+from bounded_cache import BoundedCache
+from tiered_cache import TieredCache
+
 # -----------------------------
 # Setup
 # -----------------------------
-r = redis.Redis(host="localhost", port=6379, decode_responses=True)
+r = redis.Redis(host="localhost", port=6379) # bytes - cached values may be compressed
 client = OpenAI()
 
+# answers expire after a week; past 256 MB the least recently used ones are evicted
+# hot prompts are also kept in this process for a minute (no Redis round trip)
+# keys are direct:{hash} - semantic_cache.py keeps plain-text answers under cache:{hash}
+PREFIX = "direct"
+cache = TieredCache(
+    r,
+    BoundedCache(r, prefix=PREFIX, ttl=7 * 24 * 3600, max_bytes=256 * 1024 * 1024, policy="lru"),
+    max_entries=1024,
+    ttl=60
+)
+
 
 # -----------------------------
 # Hashing
@@ -15,7 +29,7 @@ client = OpenAI()
 def make_key(prompt: str) -> str:
     normalized = prompt.strip().lower()
     hashed = hashlib.sha256(normalized.encode()).hexdigest()
-    return f"cache:{hashed}"
+    return f"{PREFIX}:{hashed}"
 
 
 # -----------------------------
@@ -35,10 +49,10 @@ def ask_llm(prompt):
 def get_answer(prompt):
     key = make_key(prompt)
 
-    # Check Redis
-    cached = r.get(key)
+    # Check memory, then Redis
+    cached, tier = cache.get(key)
     if cached:
-        print("CACHE HIT (Redis)")
+        print("CACHE HIT (memory)" if tier == "l1" else "CACHE HIT (Redis)")
         return cached
 
     # Call LLM
@@ -46,7 +60,7 @@ def get_answer(prompt):
     answer = ask_llm(prompt)
 
     # Save
-    r.set(key, answer)
+    cache.put(key, answer)
 
     return answer
 
@@ -60,4 +74,8 @@ while True:
     if q == "exit":
         break
 
+    if q == "stats":
+        print(cache.stats())
+        continue
+
     print("AI:", get_answer(q))
@@ -0,0 +1,130 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# -----------------------------
+# Two-tier cache
+# -----------------------------
+# L1: a size-bounded LRU dict in this process, with a short TTL - hot
+#     prompts are answered in microseconds without touching the network.
+# L2: Redis (BoundedCache), shared by every process.
+#
+# A put() publishes the key on INVALIDATE_CHANNEL and every other process
+# drops it from its L1. Pub/sub is fire-and-forget, so the L1 TTL bounds
+# how long a process that missed a message can serve the old value.
+#
+# L1 hits never reach Redis, so they are counted and sent to the L2's
+# LRU / LFU metadata in one call every TOUCH_INTERVAL seconds - else the
+# hottest prompts would look cold to L2 and be evicted from it first.
+
+INVALIDATE_CHANNEL = "cache:invalidate"
+TOUCH_INTERVAL = 5 # seconds
+
+
+class LocalLRU:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict() # key -> (expires_at, value)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return item[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class TieredCache:
+    """
+    get(key) / put(key, value) like BoundedCache, with a LocalLRU in front.
+    get() returns (value, tier) with tier "l1", "l2" or None on a miss.
+    """
+
+    def __init__(self, redis_client, l2, max_entries=1024, ttl=60):
+        self.r = redis_client
+        self.l1 = LocalLRU(max_entries, ttl)
+        self.l2 = l2
+        self.origin = uuid.uuid4().hex # to ignore our own invalidations
+        self.counters = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+        self.touched = {} # key -> L1 hits not reported to L2 yet
+        self.touch_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        self.toucher = threading.Thread(target=self.touch_loop, daemon=True)
+        self.toucher.start()
+
+        pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATE_CHANNEL: self.on_invalidate})
+        self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def on_invalidate(self, message):
+        data = message["data"]
+        origin, key = (data.decode() if isinstance(data, bytes) else data).split(" ", 1)
+        if origin != self.origin:
+            self.l1.discard(key)
+
+    def touch_loop(self):
+        while not self.stopped.wait(TOUCH_INTERVAL):
+            self.flush_touched()
+
+    def flush_touched(self):
+        with self.touch_lock:
+            touched, self.touched = self.touched, {}
+        try:
+            self.l2.touch(touched)
+        except Exception as e: # ordering hints only, never worth failing for
+            print(f"L2 touch failed: {e}")
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is not None:
+            self.counters["l1_hits"] += 1
+            with self.touch_lock:
+                self.touched[key] = self.touched.get(key, 0) + 1
+            return value, "l1"
+
+        value = self.l2.get(key)
+        if value is not None:
+            self.counters["l2_hits"] += 1
+            self.l1.put(key, value)
+            return value, "l2"
+
+        self.counters["misses"] += 1
+        return None, None
+
+    def put(self, key, value, ttl=None):
+        self.l1.put(key, value)
+        self.l2.put(key, value, ttl)
+        self.r.publish(INVALIDATE_CHANNEL, f"{self.origin} {key}")
+
+    def stats(self):
+        lookups = sum(self.counters.values()) or 1
+        return {
+            **self.counters,
+            "l1_hit_rate": self.counters["l1_hits"] / lookups,
+            "l2_hit_rate": self.counters["l2_hits"] / lookups,
+            "l1_entries": len(self.l1.entries)
+        }
+
+    def close(self):
+        self.stopped.set()
+        self.flush_touched()
+        self.listener.stop()
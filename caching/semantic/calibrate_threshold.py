@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import re
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from local_index import DEFAULT_NAMESPACE, LocalIndex
+
+# -----------------------------
+# Replays a labelled query log through the two-tier lookup of
+# semantic_cache.py (exact match, then similarity above a threshold) for a
+# range of thresholds, and suggests one per namespace. Runs offline:
+# embeddings come from a local model, and a miss "asks the LLM" by storing
+# the query's label as its answer. A hit is false when the answer served
+# was stored for a different label.
+#
+# Log lines are JSON with the prompt, its label (queries with the same
+# label have the same correct answer) and optionally a namespace:
+#   {"prompt": "how do I reset my password", "label": "password-reset", "namespace": "support"}
+# Without a label field every query is its own label, so any semantic hit
+# is false - e.g. the backlog, one request per line:
+#   python calibrate_threshold.py ../../requests.jsonl --prompt-field title --label-field request_id
+#
+# python calibrate_threshold.py queries.jsonl --thresholds 0.80:0.99:0.01 --max-false-rate 0.01
+# -----------------------------
+
+HASHING_DIM = 512
+
+
+# -----------------------------
+# Local embedding stand-ins
+# -----------------------------
+class HashingEmbedder:
+    """
+    Words and character trigrams hashed into a fixed-size vector. Needs
+    nothing installed; close paraphrases score high, unrelated text low.
+    """
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+
+    def features(self, text):
+        words = re.findall(r"\w+", text.casefold())
+        padded = f" {' '.join(words)} "
+        return words + [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self.features(text):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vectors
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model):
+        from sentence_transformers import SentenceTransformer # optional
+
+        self.model = SentenceTransformer(model)
+
+    def embed(self, texts):
+        return np.asarray(self.model.encode(texts, batch_size=64), dtype=np.float32)
+
+
+# -----------------------------
+# Log
+# -----------------------------
+def load_log(path, prompt_field, label_field, namespace_field):
+    records = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            prompt = record[prompt_field]
+            records.append({
+                "prompt": prompt,
+                "label": str(record.get(label_field, prompt)),
+                "namespace": record.get(namespace_field) or DEFAULT_NAMESPACE
+            })
+    return records
+
+
+def parse_thresholds(text):
+    if ":" in text:
+        start, stop, step = map(float, text.split(":"))
+        return [round(value, 4) for value in np.arange(start, stop + step / 2, step)]
+    return [float(value) for value in text.split(",")]
+
+
+# -----------------------------
+# Replay
+# -----------------------------
+def replay(records, vectors, embed_ms, threshold, llm_ms):
+    """
+    Returns {namespace: stats} for one threshold.
+    """
+    exact = {} # (namespace, normalized prompt) -> label of the stored answer
+    indexes = {}
+    stats = defaultdict(lambda: {"queries": 0, "exact": 0, "semantic": 0, "false": 0, "lookup_ms": [], "total_ms": []})
+
+    for i, record in enumerate(records):
+        namespace, label = record["namespace"], record["label"]
+        ns = stats[namespace]
+        ns["queries"] += 1
+        key = (namespace, record["prompt"].strip().lower()) # same normalization as make_key
+
+        # 1. exact match
+        started = time.perf_counter()
+        served = exact.get(key)
+        if served is not None:
+            lookup = (time.perf_counter() - started) * 1000
+            ns["exact"] += 1
+            ns["false"] += served != label
+            ns["lookup_ms"].append(lookup)
+            ns["total_ms"].append(lookup)
+            continue
+
+        # 2. semantic match (the embedding time is measured once, up front)
+        index = indexes.setdefault(namespace, LocalIndex(vectors.shape[1]))
+        hits = index.search(vectors[i], k=1)
+        lookup = (time.perf_counter() - started) * 1000 + embed_ms
+        ns["lookup_ms"].append(lookup)
+
+        if hits and hits[0][1] > threshold:
+            served = hits[0][2]["label"]
+            ns["semantic"] += 1
+            ns["false"] += served != label
+            ns["total_ms"].append(lookup)
+            exact[key] = served
+            continue
+
+        # 3. miss: the stand-in LLM answers correctly, the answer is cached
+        ns["total_ms"].append(lookup + llm_ms)
+        exact[key] = label
+        index.add(str(i), vectors[i], {"label": label})
+
+    return stats
+
+
+def summarize(ns):
+    hits = ns["exact"] + ns["semantic"]
+    return {
+        "hit_rate": hits / ns["queries"],
+        "semantic_rate": ns["semantic"] / ns["queries"],
+        "false_rate": ns["false"] / hits if hits else 0.0,
+        "p50_ms": float(np.percentile(ns["lookup_ms"], 50)),
+        "p95_ms": float(np.percentile(ns["lookup_ms"], 95)),
+        "mean_total_ms": float(np.mean(ns["total_ms"]))
+    }
+
+
+def suggest(results, max_false_rate):
+    """
+    The threshold with the best hit rate among those whose false-hit rate
+    is within max_false_rate (the highest one on a tie), else the highest.
+    """
+    within = [(row["hit_rate"], threshold) for threshold, row in results if row["false_rate"] <= max_false_rate]
+    if not within:
+        return max(threshold for threshold, _ in results), False
+    return max(within)[1], True
+
+
+def ceiling(records):
+    # hit rate of a perfect cache: every query whose label was seen before in its namespace
+    seen, repeats = set(), defaultdict(int)
+    totals = defaultdict(int)
+    for record in records:
+        key = (record["namespace"], record["label"])
+        repeats[record["namespace"]] += key in seen
+        totals[record["namespace"]] += 1
+        seen.add(key)
+    return {namespace: repeats[namespace] / totals[namespace] for namespace in totals}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Similarity threshold vs hit rate and false hits")
+    parser.add_argument("log", help="labelled query log, JSONL")
+    parser.add_argument("--prompt-field", default="prompt")
+    parser.add_argument("--label-field", default="label")
+    parser.add_argument("--namespace-field", default="namespace")
+    parser.add_argument("--thresholds", default="0.80:0.99:0.01", help="start:stop:step or a comma-separated list")
+    parser.add_argument("--max-false-rate", type=float, default=0.01, help="tolerated share of wrong cached answers")
+    parser.add_argument("--llm-ms", type=float, default=1500, help="modelled latency of an LLM call")
+    parser.add_argument("--model", help="sentence-transformers model, hashed features if not given")
+    args = parser.parse_args()
+
+    records = load_log(args.log, args.prompt_field, args.label_field, args.namespace_field)
+    embedder = SentenceTransformerEmbedder(args.model) if args.model else HashingEmbedder()
+
+    started = time.perf_counter()
+    vectors = embedder.embed([record["prompt"] for record in records])
+    embed_ms = (time.perf_counter() - started) * 1000 / len(records)
+    print(f"{len(records)} queries, embedding {embed_ms:.2f} ms/query\n")
+
+    thresholds = parse_thresholds(args.thresholds)
+    by_namespace = defaultdict(list)
+    for threshold in thresholds:
+        for namespace, ns in replay(records, vectors, embed_ms, threshold, args.llm_ms).items():
+            by_namespace[namespace].append((threshold, summarize(ns)))
+
+    best_possible = ceiling(records)
+    suggestions = {}
+    for namespace, results in sorted(by_namespace.items()):
+        print(f"namespace {namespace}: best possible hit rate {best_possible[namespace]:.3f}")
+        print(f"{'threshold':>9} {'hit rate':>9} {'semantic':>9} {'false':>7} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>9}")
+        for threshold, row in results:
+            print(f"{threshold:>9.2f} {row['hit_rate']:>9.3f} {row['semantic_rate']:>9.3f} {row['false_rate']:>7.3f} "
+                  f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['mean_total_ms']:>9.1f}")
+
+        threshold, ok = suggest(results, args.max_false_rate)
+        suggestions[namespace] = threshold
+        note = "" if ok else f" (no threshold keeps false hits under {args.max_false_rate}, using the strictest)"
+        print(f"suggested: {threshold:.2f}{note}\n")
+
+    print(f"SEMANTIC_CACHE_THRESHOLDS='{json.dumps(suggestions)}'")
@@ -0,0 +1,129 @@
+import threading
+import time
+
+from qdrant_client.models import PointIdsList, SetPayload, SetPayloadOperation
+
+from local_index import namespace_of
+
+# -----------------------------
+# Capacity management for the semantic cache collection
+# -----------------------------
+# Every entry's payload carries:
+#   created_at, expires_at   set on insert, refreshed when a near-duplicate replaces it
+#   hits, last_hit_at        counted in the mirror, written back here in one batch
+#
+# Every `every` seconds the evictor:
+# 1. writes the hit counts recorded since the last pass back to Qdrant
+# 2. drops expired entries
+# 3. drops near-duplicates among the entries added since the last pass,
+#    keeping the one with more hits
+# 4. drops the least used entries (fewest hits, then least recently hit)
+#    until at most max_entries are left
+#
+# The collection stays at a steady size, so search latency stays flat.
+
+DEDUP_THRESHOLD = 0.95 # cosine similarity above which two prompts are the same entry
+
+
+def entry_payload(prompt, answer, ttl, previous=None):
+    # hits carry over when a near-duplicate refreshes an existing entry
+    now = time.time()
+    return {
+        "prompt": prompt,
+        "answer": answer,
+        "created_at": now,
+        "expires_at": now + ttl,
+        "hits": (previous or {}).get("hits", 0),
+        "last_hit_at": (previous or {}).get("last_hit_at", now)
+    }
+
+
+def usage(payload):
+    # eviction order, least used first
+    return payload.get("hits", 0), payload.get("last_hit_at", payload.get("created_at", 0))
+
+
+class CacheEvictor:
+    def __init__(self, mirror, max_entries=10000, every=60):
+        self.mirror = mirror
+        self.max_entries = max_entries
+        self.counters = {"expired": 0, "duplicates": 0, "over_capacity": 0}
+
+        if every:
+            thread = threading.Thread(target=self.loop, args=(every,), daemon=True)
+            thread.start()
+
+    def loop(self, every):
+        while True:
+            time.sleep(every)
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"semantic cache eviction failed: {e}")
+
+    def flush_hits(self):
+        dirty = self.mirror.take_dirty()
+        if not dirty:
+            return
+        self.mirror.qdrant.batch_update_points(
+            collection_name=self.mirror.collection,
+            update_operations=[
+                SetPayloadOperation(set_payload=SetPayload(
+                    payload={"hits": payload.get("hits", 0), "last_hit_at": payload.get("last_hit_at")},
+                    points=[point_id]
+                ))
+                for point_id, payload in dirty.items()
+            ]
+        )
+
+    def duplicates(self, entries):
+        dropped = set()
+        for point_id in self.mirror.take_recent():
+            if point_id not in entries or point_id in dropped:
+                continue
+            try:
+                vector = self.mirror.vector(point_id)
+            except KeyError: # removed since the snapshot
+                continue
+            namespace = namespace_of(entries[point_id])
+            for other, score, _ in self.mirror.search(vector, k=2, include_expired=True, namespace=namespace):
+                if other == point_id or other in dropped or score < DEDUP_THRESHOLD:
+                    continue
+                dropped.add(min(point_id, other, key=lambda entry: usage(entries.get(entry, {}))))
+                break
+        return dropped
+
+    def run_once(self):
+        """
+        Returns the ids removed.
+        """
+        self.flush_hits()
+
+        now = time.time()
+        entries = self.mirror.snapshot()
+        expired = {point_id for point_id, payload in entries.items()
+                   if payload.get("expires_at", float("inf")) <= now}
+        duplicates = self.duplicates(entries) - expired
+
+        remaining = sorted(
+            (point_id for point_id in entries if point_id not in expired and point_id not in duplicates),
+            key=lambda point_id: usage(entries[point_id])
+        )
+        over_capacity = remaining[:max(len(remaining) - self.max_entries, 0)]
+
+        victims = [*expired, *duplicates, *over_capacity]
+        if not victims:
+            return []
+
+        # durable first, then gone locally
+        self.mirror.qdrant.delete(
+            collection_name=self.mirror.collection,
+            points_selector=PointIdsList(points=victims)
+        )
+        for point_id in victims:
+            self.mirror.remove(point_id)
+
+        self.counters["expired"] += len(expired)
+        self.counters["duplicates"] += len(duplicates)
+        self.counters["over_capacity"] += len(over_capacity)
+        return victims
@@ -0,0 +1,338 @@
+import threading
+import time
+
+import numpy as np
+from qdrant_client.models import PointStruct
+
+# -----------------------------
+# In-process mirror of the Qdrant cache collection
+# -----------------------------
+# Lookups search a local index (hnswlib if installed, else exact numpy
+# search) instead of calling Qdrant, which stays the durable store:
+# - load() copies the collection at startup
+# - add() / remove() keep the mirror in step with this process's writes
+# - a background thread reloads it every reconcile_every seconds, picking
+#   up writes and deletes of other processes
+#
+# Scores are cosine similarities, the same as Qdrant's COSINE distance.
+#
+# Payloads carry expires_at and hits (see eviction.py): search() skips
+# expired entries, and hits recorded locally are written back to Qdrant
+# in batches by the evictor instead of one call per lookup.
+#
+# Each namespace (payload "namespace") has its own index, so near-identical
+# prompts cached by other deployments never crowd its entries out of the
+# top k.
+
+DEFAULT_NAMESPACE = "default" # entries without a namespace
+
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / max(np.linalg.norm(vector), 1e-12)
+
+
+class LocalIndex:
+    """
+    point id -> (vector, payload), searchable by cosine similarity.
+    Not thread-safe by itself; SemanticMirror locks around it.
+    """
+
+    def __init__(self, dim, capacity=1024):
+        self.dim = dim
+        self.capacity = capacity
+        self.labels = {} # point id -> row / hnsw label
+        self.ids = {} # row -> point id
+        self.payloads = {}
+        self.free = []
+        self.next_label = 0
+
+        try:
+            import hnswlib # optional, exact numpy search without it
+
+            self.hnsw = hnswlib.Index(space="ip", dim=dim)
+            self.hnsw.init_index(max_elements=capacity, M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+            self.hnsw.set_ef(HNSW_EF_SEARCH)
+        except ImportError:
+            self.hnsw = None
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+            self.alive = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def grow(self):
+        self.capacity *= 2
+        if self.hnsw is not None:
+            self.hnsw.resize_index(self.capacity)
+        else:
+            added = self.capacity - len(self.alive)
+            self.vectors = np.concatenate([self.vectors, np.zeros((added, self.dim), dtype=np.float32)])
+            self.alive = np.concatenate([self.alive, np.zeros(added, dtype=bool)])
+
+    def add(self, point_id, vector, payload):
+        if point_id in self.labels:
+            self.remove(point_id)
+
+        if self.free:
+            label = self.free.pop()
+        else:
+            if self.next_label == self.capacity:
+                self.grow()
+            label = self.next_label
+            self.next_label += 1
+
+        vector = normalize(vector)
+        if self.hnsw is not None:
+            # a freed label is re-added under the same label: hnswlib un-deletes
+            # that exact slot (replace_deleted would pick a slot of its own)
+            self.hnsw.add_items(vector[None, :], [label])
+        else:
+            self.vectors[label] = vector
+            self.alive[label] = True
+
+        self.labels[point_id] = label
+        self.ids[label] = point_id
+        self.payloads[point_id] = payload
+
+    def vector(self, point_id):
+        label = self.labels[point_id]
+        if self.hnsw is not None:
+            return np.asarray(self.hnsw.get_items([label])[0], dtype=np.float32)
+        return self.vectors[label]
+
+    def remove(self, point_id):
+        label = self.labels.pop(point_id, None)
+        if label is None:
+            return
+        if self.hnsw is not None:
+            self.hnsw.mark_deleted(label)
+        else:
+            self.alive[label] = False
+        del self.ids[label]
+        del self.payloads[point_id]
+        self.free.append(label)
+
+    def search(self, vector, k=1):
+        """
+        Returns [(point id, score, payload)], best first.
+        """
+        if not self.labels:
+            return []
+        k = min(k, len(self.labels))
+        query = normalize(vector)
+
+        if self.hnsw is not None:
+            labels, distances = self.hnsw.knn_query(query, k=k)
+            # "ip" distance is 1 - inner product
+            hits = [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+        else:
+            scores = self.vectors[:self.next_label] @ query
+            scores[~self.alive[:self.next_label]] = -np.inf
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            hits = [(int(label), float(scores[label])) for label in top]
+
+        return [(self.ids[label], score, self.payloads[self.ids[label]]) for label, score in hits]
+
+
+def namespace_of(payload) -> str:
+    return payload.get("namespace") or DEFAULT_NAMESPACE
+
+
+class NamespacedIndex:
+    """
+    One LocalIndex per namespace behind the same add / remove / search.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.indexes = {} # namespace -> LocalIndex
+        self.namespaces = {} # point id -> namespace
+
+    def __len__(self):
+        return len(self.namespaces)
+
+    def add(self, point_id, vector, payload):
+        self.remove(point_id)
+        namespace = namespace_of(payload)
+        if namespace not in self.indexes:
+            self.indexes[namespace] = LocalIndex(self.dim)
+        self.indexes[namespace].add(point_id, vector, payload)
+        self.namespaces[point_id] = namespace
+
+    def remove(self, point_id):
+        namespace = self.namespaces.pop(point_id, None)
+        if namespace is not None:
+            self.indexes[namespace].remove(point_id)
+
+    def payload(self, point_id):
+        namespace = self.namespaces.get(point_id)
+        return None if namespace is None else self.indexes[namespace].payloads[point_id]
+
+    def payloads(self):
+        for index in self.indexes.values():
+            yield from index.payloads.items()
+
+    def vector(self, point_id):
+        return self.indexes[self.namespaces[point_id]].vector(point_id)
+
+    def search(self, vector, k, namespace):
+        index = self.indexes.get(namespace)
+        return [] if index is None else index.search(vector, k)
+
+
+class SemanticMirror:
+    def __init__(self, qdrant, collection, dim, reconcile_every=60):
+        self.qdrant = qdrant
+        self.collection = collection
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.index = NamespacedIndex(dim)
+        self.reloading = None # writes made while a reload is running, replayed after it
+        self.dirty = set() # ids whose hits changed since the last flush to Qdrant
+        self.recent = set() # ids added since the evictor last checked for near-duplicates
+
+        self.load()
+        if reconcile_every:
+            thread = threading.Thread(target=self.reconcile_loop, args=(reconcile_every,), daemon=True)
+            thread.start()
+
+    def load(self, batch_size=512):
+        with self.lock:
+            self.reloading = []
+
+        index = NamespacedIndex(self.dim)
+        offset = None
+        while True:
+            points, offset = self.qdrant.scroll(
+                collection_name=self.collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=True
+            )
+            for point in points:
+                index.add(str(point.id), point.vector, point.payload)
+            if offset is None:
+                break
+
+        with self.lock:
+            for action, args in self.reloading:
+                getattr(index, action)(*args)
+            # hit counts not flushed yet are newer than what Qdrant has
+            for point_id in self.dirty:
+                fresh, local = index.payload(point_id), self.index.payload(point_id)
+                if fresh is not None and local is not None:
+                    fresh.update(hits=local.get("hits", 0), last_hit_at=local.get("last_hit_at"))
+            self.index = index
+            self.reloading = None
+
+    def reconcile_loop(self, every):
+        while True:
+            time.sleep(every)
+            try:
+                self.load()
+            except Exception as e:
+                print(f"semantic cache mirror reload failed: {e}")
+                with self.lock:
+                    self.reloading = None
+
+    def search(self, vector, k=1, include_expired=False, namespace=DEFAULT_NAMESPACE):
+        now = time.time()
+        with self.lock:
+            # a few extra candidates, in case the best ones have expired
+            hits = self.index.search(vector, k if include_expired else k + 4, namespace)
+        if not include_expired:
+            hits = [hit for hit in hits if hit[2].get("expires_at", float("inf")) > now]
+        return hits[:k]
+
+    def record_hit(self, point_id):
+        with self.lock:
+            payload = self.index.payload(point_id)
+            if payload is None:
+                return
+            payload["hits"] = payload.get("hits", 0) + 1
+            payload["last_hit_at"] = time.time()
+            self.dirty.add(point_id)
+
+    def take_dirty(self):
+        # {id: payload} of entries with new hits, for the evictor to write back
+        with self.lock:
+            dirty = {point_id: dict(self.index.payload(point_id))
+                     for point_id in self.dirty if self.index.payload(point_id) is not None}
+            self.dirty = set()
+        return dirty
+
+    def take_recent(self):
+        with self.lock:
+            recent = self.recent
+            self.recent = set()
+        return recent
+
+    def snapshot(self):
+        # {id: payload} of every entry
+        with self.lock:
+            return {point_id: dict(payload) for point_id, payload in self.index.payloads()}
+
+    def vector(self, point_id):
+        with self.lock:
+            return self.index.vector(point_id)
+
+    def add(self, point_id, vector, payload):
+        with self.lock:
+            self.index.add(point_id, vector, payload)
+            self.recent.add(point_id)
+            if self.reloading is not None:
+                self.reloading.append(("add", (point_id, vector, payload)))
+
+    def remove(self, point_id):
+        with self.lock:
+            self.index.remove(point_id)
+            if self.reloading is not None:
+                self.reloading.append(("remove", (point_id,)))
+
+    def upsert(self, point_id, vector, payload):
+        # durable first, then visible locally
+        self.qdrant.upsert(
+            collection_name=self.collection,
+            points=[PointStruct(id=point_id, vector=vector, payload=payload)]
+        )
+        self.add(point_id, vector, payload)
+
+    def __len__(self):
+        return len(self.index)
+
+
+if __name__ == "__main__":
+    # regression check: random add / re-add / remove sequences, every live
+    # entry must keep its own vector and be its own nearest neighbour
+    import argparse
+    import random
+
+    parser = argparse.ArgumentParser(description="LocalIndex remove-then-add consistency check")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--steps", type=int, default=400)
+    parser.add_argument("--dim", type=int, default=8)
+    args = parser.parse_args()
+
+    for seed in range(args.rounds):
+        rng, picks = np.random.default_rng(seed), random.Random(seed)
+        index, live = LocalIndex(args.dim, capacity=16), {}
+        for step in range(args.steps):
+            if live and picks.random() < 0.45:
+                point_id = picks.choice(list(live))
+                index.remove(point_id)
+                del live[point_id]
+            else:
+                point_id = f"p{picks.randrange(60)}"
+                live[point_id] = normalize(rng.normal(size=args.dim))
+                index.add(point_id, live[point_id], {"id": point_id})
+            for point_id, vector in live.items():
+                assert np.allclose(index.vector(point_id), vector, atol=1e-5), (seed, step, point_id)
+                assert index.search(vector, k=1)[0][0] == point_id, (seed, step, point_id)
+    print(f"ok: {args.rounds} rounds of {args.steps} steps, {'hnswlib' if index.hnsw is not None else 'numpy'}")
@@ -1,10 +1,20 @@
 import hashlib
+import json
+import os
+import sys
 import uuid
+from pathlib import Path
 
 import redis
 from openai import OpenAI
 from qdrant_client import QdrantClient
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import VectorParams, Distance
+
+from eviction import DEDUP_THRESHOLD, CacheEvictor, entry_payload
+from local_index import DEFAULT_NAMESPACE, SemanticMirror
+
+sys.path.append(str(Path(__file__).resolve().parents[2] / "common"))
+from embedding_cache import cached_embeddings
 
 # -----------------------------
 # Setup
@@ -14,6 +24,17 @@ qdrant = QdrantClient(host="localhost", port=6333)
 client = OpenAI()
 
 COLLECTION = "cache"
+EMBEDDING_DIM = 1536 # text-embedding-3-small
+ENTRY_TTL = 7 * 24 * 3600
+MAX_ENTRIES = 10000
+
+# Similarity above which a cached answer is served, per deployment:
+#   SEMANTIC_CACHE_NAMESPACE=billing
+#   SEMANTIC_CACHE_THRESHOLDS='{"billing": 0.93, "docs": 0.88}'
+# calibrate_threshold.py suggests these values from a labelled query log.
+NAMESPACE = os.environ.get("SEMANTIC_CACHE_NAMESPACE", DEFAULT_NAMESPACE)
+THRESHOLDS = json.loads(os.environ.get("SEMANTIC_CACHE_THRESHOLDS", "{}"))
+SIMILARITY_THRESHOLD = float(THRESHOLDS.get(NAMESPACE, os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.9)))
 
 
 # -----------------------------
@@ -22,6 +43,8 @@ COLLECTION = "cache"
 def make_key(prompt: str) -> str:
     normalized = prompt.strip().lower()
     hashed = hashlib.sha256(normalized.encode()).hexdigest()
+    if NAMESPACE != DEFAULT_NAMESPACE:
+        return f"cache:{NAMESPACE}:{hashed}"
     return f"cache:{hashed}"
 
 
@@ -29,11 +52,8 @@ def make_key(prompt: str) -> str:
 # Embedding
 # -----------------------------
 def get_embedding(text):
-    res = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return res.data[0].embedding
+    # only calls the API the first time a text is seen
+    return cached_embeddings(client, "text-embedding-3-small", [text])[0]
 
 
 # -----------------------------
@@ -66,20 +86,24 @@ def ask_llm(prompt):
 # -----------------------------
 # Semantic search
 # -----------------------------
+def nearest(embedding, include_expired=False):
+    # in-process mirror of the collection, no Qdrant round trip;
+    # only this deployment's namespace is searched
+    hits = mirror.search(embedding, k=1, include_expired=include_expired, namespace=NAMESPACE)
+    return hits[0] if hits else None
+
+
 def search_cache(embedding):
-    res = qdrant.query_points(
-        collection_name=COLLECTION,
-        query=embedding,
-        limit=1
-    )
+    hit = nearest(embedding)
 
-    if len(res.points) == 0:
+    if hit is None:
         return None
 
-    point = res.points[0]
+    point_id, score, payload = hit
 
-    if point.score > 0.9:
-        return point.payload["answer"]
+    if score > SIMILARITY_THRESHOLD:
+        mirror.record_hit(point_id)
+        return payload["answer"]
 
     return None
 
@@ -88,19 +112,19 @@ def search_cache(embedding):
 # Save to Qdrant
 # -----------------------------
 def save_cache(prompt, embedding, answer):
-    qdrant.upsert(
-        collection_name=COLLECTION,
-        points=[
-            PointStruct(
-                id=str(uuid.uuid4()),
-                vector=embedding,
-                payload={
-                    "prompt": prompt,
-                    "answer": answer
-                }
-            )
-        ]
-    )
+    # a near-duplicate prompt (expired, or written by another process
+    # meanwhile) is refreshed in place instead of becoming a second entry
+    hit = nearest(embedding, include_expired=True)
+    if hit is not None and hit[1] >= DEDUP_THRESHOLD:
+        point_id, _, previous = hit
+    else:
+        point_id, previous = str(uuid.uuid4()), None
+
+    payload = entry_payload(prompt, answer, ENTRY_TTL, previous)
+    payload["namespace"] = NAMESPACE
+
+    # Qdrant stays the durable store, the mirror is updated right after
+    mirror.upsert(point_id, embedding, payload)
 
 
 # -----------------------------
@@ -118,27 +142,34 @@ def get_answer(prompt):
     # 2. Embedding
     emb = get_embedding(prompt)
 
-    # 3. Init collection
-    init_collection(len(emb))
-
-    # 4. Semantic cache
+    # 3. Semantic cache
     semantic = search_cache(emb)
     if semantic:
         print("QDRANT HIT")
         r.set(key, semantic)
         return semantic
 
-    # 5. LLM fallback
+    # 4. LLM fallback
     print("LLM CALL")
     answer = ask_llm(prompt)
 
-    # 6. Save
+    # 5. Save
     r.set(key, answer)
     save_cache(prompt, emb, answer)
 
     return answer
 
 
+# -----------------------------
+# Startup: collection check and local mirror, once
+# -----------------------------
+init_collection(EMBEDDING_DIM)
+mirror = SemanticMirror(qdrant, COLLECTION, EMBEDDING_DIM, reconcile_every=60)
+evictor = CacheEvictor(mirror, MAX_ENTRIES, every=60)
+print(f"semantic cache: {len(mirror)} entries loaded, at most {MAX_ENTRIES} kept, "
+      f"namespace {NAMESPACE}, threshold {SIMILARITY_THRESHOLD}")
+
+
 # -----------------------------
 # Run loop
 # -----------------------------
@@ -0,0 +1,67 @@
+"""
+bm25.py
+
+BM25 sparse vectors for hybrid search. Qdrant keeps them in an inverted
+index next to the dense vectors and applies IDF itself (Modifier.IDF), so
+document frequencies stay correct as chunks are added and removed - the
+client only sends term frequencies.
+
+Terms are hashed to 32-bit ids, so there is no vocabulary file to maintain.
+Ansible module names and flags (ansible.builtin.copy, become_user, --check)
+are kept as whole terms, and dotted names are also indexed by their parts.
+"""
+
+import re
+import zlib
+from collections import Counter
+
+from qdrant_client import models
+
+K1 = 1.2
+B = 0.75
+AVG_DOC_LENGTH = 150 # tokens in a 1000-character chunk, roughly
+
+TOKEN_PATTERN = re.compile(r"-{0,2}[a-z0-9][a-z0-9_.\-]*[a-z0-9_]|-{0,2}[a-z0-9]")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how",
+    "i", "if", "in", "is", "it", "of", "on", "or", "that", "the", "this", "to", "was", "what",
+    "when", "which", "with", "you", "your"
+}
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if "." in token:
+            tokens.extend(part for part in token.split(".") if part and part not in STOPWORDS)
+    return tokens
+
+
+def term_id(term: str) -> int:
+    return zlib.crc32(term.encode())
+
+
+def sparse_document(text: str) -> models.SparseVector:
+    """
+    BM25 term-frequency part of every term in a chunk.
+    """
+    counts = Counter(term_id(token) for token in tokenize(text))
+    length = sum(counts.values())
+    norm = K1 * (1 - B + B * length / AVG_DOC_LENGTH)
+
+    return models.SparseVector(
+        indices=list(counts),
+        values=[tf * (K1 + 1) / (tf + norm) for tf in counts.values()]
+    )
+
+
+def sparse_query(text: str) -> models.SparseVector:
+    """
+    Every distinct query term with weight 1 - Qdrant multiplies in the IDF.
+    """
+    terms = sorted({term_id(token) for token in tokenize(text)})
+    return models.SparseVector(indices=terms, values=[1.0] * len(terms))
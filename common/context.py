@@ -0,0 +1,188 @@
+"""
+context.py
+
+Builds the "Context:" section of the RAG system prompt from retrieved chunks.
+
+The indexer splits pages with chunk_overlap=400, so neighbouring chunks
+repeat up to 40% of each other's text. Instead of pasting every chunk
+verbatim this:
+
+1. merges chunks from the same page that overlap or touch into one block
+   (by their start_index, or by matching text when that is missing)
+2. drops blocks that are near-duplicates of a better-ranked block
+3. adds blocks best-ranked first until RAG_CONTEXT_TOKENS is reached
+   (counted locally with tiktoken); the best block is cut to the budget
+   if it is too long on its own, so the context is never empty
+
+The block format is the one the prompts already use.
+"""
+
+import os
+
+import tiktoken
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONTEXT_TOKENS = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+MIN_TEXT_OVERLAP = 40 # characters, for chunks indexed without start_index
+DUPLICATE_SIMILARITY = 0.8 # shingle Jaccard above which a block is dropped
+SHINGLE_SIZE = 5 # words
+
+SEPARATOR = "----\n\n"
+
+encoding = tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(encoding.encode(text))
+
+
+def format_block(text: str, page) -> str:
+    block = f"""
+Page Content: {text}
+Page Number: {page}
+"""
+    return block.strip()
+
+
+# ---------------------------------------------------------
+# Merge overlapping chunks
+# ---------------------------------------------------------
+def text_overlap(left: str, right: str) -> int:
+    """
+    Length of the longest suffix of left that is a prefix of right.
+    """
+    for size in range(min(len(left), len(right)), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def join_chunks(left: tuple, right: tuple):
+    """
+    The two (rank, start, text) chunks as one if they overlap or touch, else None.
+    """
+    rank = min(left[0], right[0])
+
+    if left[1] is not None and right[1] is not None:
+        (_, first_start, first), (_, start, text) = sorted([left, right], key=lambda chunk: chunk[1])
+        end = first_start + len(first)
+        if start <= end:
+            return rank, first_start, first + text[end - start:]
+        return None
+
+    for (_, first_start, first), (_, start, text) in ((left, right), (right, left)):
+        if text in first:
+            return rank, first_start, first
+        overlap = text_overlap(first, text)
+        if overlap:
+            return rank, first_start, first + text[overlap:]
+    return None
+
+
+def merge_page(chunks: list) -> list:
+    """
+    chunks: [(rank, start, text)] of one page. Returns merged [(rank, start, text)].
+
+    Chunks come in rank order, not page order, and a later chunk can bridge
+    two blocks that did not touch before, so every pair is tried again
+    until nothing merges.
+    """
+    merged = list(chunks)
+    joined = True
+    while joined:
+        joined = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                block = join_chunks(merged[i], merged[j])
+                if block is not None:
+                    merged[i] = block
+                    del merged[j]
+                    joined = True
+                    break
+            if joined:
+                break
+    return merged
+
+
+# ---------------------------------------------------------
+# Near-duplicates
+# ---------------------------------------------------------
+def shingles(text: str) -> set:
+    words = text.lower().split()
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def is_duplicate(candidate: set, kept: list) -> bool:
+    for other in kept:
+        common = len(candidate & other)
+        if not candidate or common / len(candidate | other) >= DUPLICATE_SIMILARITY:
+            return True
+        # contained in a bigger block
+        if common / len(candidate) >= DUPLICATE_SIMILARITY:
+            return True
+    return False
+
+
+def truncate_block(text: str, page, max_tokens: int) -> str:
+    """
+    The formatted block with its text cut to fit max_tokens, None if not even the header fits.
+    """
+    tokens = encoding.encode(text)
+    budget = max_tokens - count_tokens(format_block("", page))
+    while budget > 0:
+        block = format_block(encoding.decode(tokens[:budget]), page)
+        # decoding and re-encoding at the cut can change the count slightly
+        if count_tokens(block) <= max_tokens:
+            return block
+        budget -= 1
+    return None
+
+
+# ---------------------------------------------------------
+# Pack
+# ---------------------------------------------------------
+def pack_context(documents: list, max_tokens: int = CONTEXT_TOKENS) -> str:
+    """
+    documents: retrieved chunks, best match first.
+    """
+    pages = {}
+    for rank, item in enumerate(documents):
+        key = (item.metadata.get("source"), item.metadata.get("page", "NA"))
+        pages.setdefault(key, []).append((rank, item.metadata.get("start_index"), item.page_content))
+
+    blocks = []
+    for (_, page), chunks in pages.items():
+        for rank, _, text in merge_page(chunks):
+            blocks.append((rank, page, text))
+    blocks.sort(key=lambda block: block[0])
+
+    context = []
+    kept = []
+    used = 0
+    separator_tokens = count_tokens(SEPARATOR)
+
+    for _, page, text in blocks:
+        text_shingles = shingles(text)
+        if is_duplicate(text_shingles, kept):
+            continue
+
+        block = format_block(text, page)
+        tokens = count_tokens(block) + (separator_tokens if context else 0)
+        if used + tokens > max_tokens:
+            if context:
+                continue
+            # the best match alone is over the budget - keep its beginning rather than nothing
+            block = truncate_block(text, page, max_tokens)
+            if block is None:
+                continue
+            tokens = count_tokens(block)
+
+        context.append(block)
+        kept.append(text_shingles)
+        used += tokens
+
+    return SEPARATOR.join(context)
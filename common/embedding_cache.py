@@ -0,0 +1,340 @@
+"""
+embedding_cache.py
+
+Local embedding cache shared by the indexer, the RAG scripts, the semantic
+cache and the MCP server. Text that was embedded once is never sent to the
+embeddings API again.
+
+Layout on disk (EMBEDDING_CACHE_DIR, default ~/.cache/gen-ai/embeddings):
+
+- CURRENT              generation number of the live files
+- vectors.<gen>.f32    append-only float32 vectors, memory-mapped for reads
+- index.<gen>.bin      append-only (key, offset, dim) records, 28 bytes each
+- cache.lock           flock taken by writers
+
+Keys are the first 16 bytes of sha256(model, dimensions, text).
+
+Writers append the vector first and the index record second while holding
+the lock, so readers never need a lock: a key they can see always points at
+data that is already on disk. When the vectors file grows past max_bytes the
+oldest entries are evicted by rewriting the newest half into the next
+generation; readers notice the new CURRENT and reopen. The previous
+generation's files are only deleted by the eviction after that, and a
+reader that still finds them gone re-reads CURRENT and retries.
+
+One instance is shared by every thread of a process (default_cache()), so
+the in-memory index is guarded by a threading lock as well.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError: # semantic cache / MCP server don't need langchain
+    Embeddings = object
+
+# ---------------------------------------------------------
+# Defaults (EMBEDDING_CACHE_DIR / EMBEDDING_CACHE_MAX_BYTES override them)
+# ---------------------------------------------------------
+DEFAULT_DIR = str(Path.home() / ".cache" / "gen-ai" / "embeddings")
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+INDEX_RECORD = np.dtype([("key", "V16"), ("offset", "<u8"), ("dim", "<u4")])
+
+
+def cache_key(model: str, dimensions, text: str) -> bytes:
+    raw = f"{model}\0{dimensions or ''}\0{text}".encode()
+    return hashlib.sha256(raw).digest()[:16]
+
+
+# ---------------------------------------------------------
+# Cache
+# ---------------------------------------------------------
+class EmbeddingCache:
+
+    def __init__(self, path: str = None, max_bytes: int = None):
+        # read the environment here, not at import, so load_dotenv() order doesn't matter
+        self.path = Path(path or os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_DIR))
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes or int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+
+        self.generation = None
+        self.entries = {}
+        self.index_position = 0
+        self.vectors = None
+        # reentrant: put_many and get_many refresh and look up while holding it
+        self.mutex = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._refresh()
+
+    # -----------------------------
+    # Files
+    # -----------------------------
+    def _vectors_file(self, generation: int) -> Path:
+        return self.path / f"vectors.{generation}.f32"
+
+    def _index_file(self, generation: int) -> Path:
+        return self.path / f"index.{generation}.bin"
+
+    def _current_generation(self) -> int:
+        try:
+            return int((self.path / "CURRENT").read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path / "cache.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # -----------------------------
+    # Pick up what other processes wrote
+    # -----------------------------
+    def _refresh(self):
+        with self.mutex:
+            for _ in range(3):
+                try:
+                    return self._read_index()
+                except FileNotFoundError: # evicted between reading CURRENT and opening the index
+                    self.generation = None
+
+    def _read_index(self):
+        generation = self._current_generation()
+        if generation != self.generation:
+            self.generation = generation
+            self.entries = {}
+            self.index_position = 0
+            self.vectors = None
+
+        index_file = self._index_file(generation)
+        if not index_file.exists():
+            return
+
+        size = index_file.stat().st_size
+        usable = size - size % INDEX_RECORD.itemsize
+        if usable > self.index_position:
+            with open(index_file, "rb") as f:
+                f.seek(self.index_position)
+                records = np.frombuffer(f.read(usable - self.index_position), dtype=INDEX_RECORD)
+            for record in records:
+                self.entries[bytes(record["key"])] = (int(record["offset"]), int(record["dim"]))
+            self.index_position = usable
+
+    def _vector(self, offset: int, dim: int) -> np.ndarray:
+        if self.vectors is None or offset + dim > len(self.vectors):
+            self.vectors = np.memmap(self._vectors_file(self.generation), dtype="<f4", mode="r")
+        return np.array(self.vectors[offset:offset + dim])
+
+    def _lookup(self, key: bytes):
+        with self.mutex:
+            for _ in range(3):
+                entry = self.entries.get(key)
+                if entry is None:
+                    return None
+                try:
+                    return self._vector(*entry)
+                except FileNotFoundError: # another process evicted this generation meanwhile
+                    self.generation = None
+                    self._refresh()
+        return None
+
+    # -----------------------------
+    # Batch get / put
+    # -----------------------------
+    def get_many(self, model: str, dimensions, texts: list) -> list:
+        """
+        Returns one float32 vector per text, None where the text is not cached.
+        """
+        with self.mutex:
+            self._refresh()
+
+            results = []
+            for text in texts:
+                vector = self._lookup(cache_key(model, dimensions, text))
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, model: str, dimensions, texts: list, vectors: list):
+        with self.mutex, self._locked():
+            self._refresh()
+
+            keys = []
+            rows = []
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, dimensions, text)
+                if key not in self.entries and key not in keys:
+                    keys.append(key)
+                    rows.append(np.asarray(vector, dtype="<f4"))
+            if not rows:
+                return
+
+            vectors_file = self._vectors_file(self.generation)
+            with open(vectors_file, "ab") as f:
+                offset = f.tell() // 4
+                for row in rows:
+                    f.write(row.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            records = np.zeros(len(rows), dtype=INDEX_RECORD)
+            for i, (key, row) in enumerate(zip(keys, rows)):
+                records[i] = (key, offset, len(row))
+                offset += len(row)
+
+            with open(self._index_file(self.generation), "ab") as f:
+                f.write(records.tobytes())
+
+            if offset * 4 > self.max_bytes:
+                self._refresh()
+                self._evict()
+
+        self._refresh()
+
+    def get(self, model: str, dimensions, text: str):
+        return self.get_many(model, dimensions, [text])[0]
+
+    def put(self, model: str, dimensions, text: str, vector):
+        self.put_many(model, dimensions, [text], [vector])
+
+    # -----------------------------
+    # Eviction - keep the newest half, drop the oldest entries
+    # -----------------------------
+    def _evict(self):
+        # caller holds the lock and has just refreshed
+        ordered = sorted(self.entries.items(), key=lambda item: item[1][0], reverse=True)
+
+        kept = []
+        kept_bytes = 0
+        for key, (offset, dim) in ordered:
+            if kept_bytes + dim * 4 > self.max_bytes // 2:
+                break
+            kept.append((key, offset, dim))
+            kept_bytes += dim * 4
+        kept.reverse()
+
+        old_generation = self.generation
+        new_generation = old_generation + 1
+        source = np.memmap(self._vectors_file(old_generation), dtype="<f4", mode="r")
+
+        records = np.zeros(len(kept), dtype=INDEX_RECORD)
+        new_offset = 0
+        with open(self._vectors_file(new_generation), "wb") as f:
+            for i, (key, offset, dim) in enumerate(kept):
+                f.write(np.asarray(source[offset:offset + dim]).tobytes())
+                records[i] = (key, new_offset, dim)
+                new_offset += dim
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self._index_file(new_generation), "wb") as f:
+            f.write(records.tobytes())
+
+        current_tmp = self.path / "CURRENT.tmp"
+        current_tmp.write_text(str(new_generation))
+        os.replace(current_tmp, self.path / "CURRENT")
+
+        # readers may still be on the old generation, only the one before it goes
+        self._vectors_file(old_generation - 1).unlink(missing_ok=True)
+        self._index_file(old_generation - 1).unlink(missing_ok=True)
+
+
+# ---------------------------------------------------------
+# Raw OpenAI client helper
+# ---------------------------------------------------------
+_default_cache = None
+
+
+def default_cache() -> EmbeddingCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache()
+    return _default_cache
+
+
+def cached_embeddings(client, model: str, texts: list, dimensions=None, cache=None) -> list:
+    """
+    Same result as client.embeddings.create(...) but only the texts that
+    are not cached yet are sent to the API. Returns a list of float lists.
+    """
+    cache = cache or default_cache()
+    vectors = cache.get_many(model, dimensions, texts)
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        kwargs = {"dimensions": dimensions} if dimensions else {}
+        res = client.embeddings.create(
+            model=model,
+            input=[texts[i] for i in missing],
+            **kwargs
+        )
+        fresh = [item.embedding for item in res.data]
+        cache.put_many(model, dimensions, [texts[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+
+    return [vector.tolist() if isinstance(vector, np.ndarray) else vector for vector in vectors]
+
+
+# ---------------------------------------------------------
+# LangChain wrapper
+# ---------------------------------------------------------
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps OpenAIEmbeddings (or any embeddings with .model / .dimensions),
+    usable wherever LangChain expects an Embeddings object.
+    """
+
+    def __init__(self, embeddings, cache=None):
+        self.embeddings = embeddings
+        self.model = embeddings.model
+        self.dimensions = getattr(embeddings, "dimensions", None)
+        self.cache = cache or default_cache()
+
+    def embed_documents(self, texts: list) -> list:
+        vectors = self.cache.get_many(self.model, self.dimensions, texts)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many(self.model, self.dimensions, [texts[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+
+        return [vector.tolist() if isinstance(vector, np.ndarray) else vector for vector in vectors]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: list) -> list:
+        vectors = self.cache.get_many(self.model, self.dimensions, texts)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            fresh = await self.embeddings.aembed_documents([texts[i] for i in missing])
+            # takes a file lock and fsyncs, keep it off the event loop
+            await asyncio.to_thread(self.cache.put_many, self.model, self.dimensions, [texts[i] for i in missing], fresh)
+            for i, vector in zip(missing, fresh):
+                vectors[i] = vector
+
+        return [vector.tolist() if isinstance(vector, np.ndarray) else vector for vector in vectors]
+
+    async def aembed_query(self, text: str) -> list:
+        return (await self.aembed_documents([text]))[0]
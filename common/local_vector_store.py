@@ -0,0 +1,194 @@
+"""
+local_vector_store.py
+
+In-process vector search over a snapshot of the Qdrant collection, so a
+question costs no network round trip to the vector DB.
+
+Snapshot directory (written by rag-01/export_snapshot.py):
+
+- vectors.npy      float32, one normalized row per chunk, memory-mapped at load
+- payloads.jsonl   {"id", "page_content", "metadata"} per row
+- offsets.npy      byte offset of every payloads.jsonl line (+ end of file)
+- index.hnsw       optional HNSW graph (hnswlib) for large collections
+- meta.json        collection name, row count, dimension
+
+Both stores have the same similarity_search / asimilarity_search (and
+*_batch) interface as the Qdrant stores in retrieval.py.
+"""
+
+import json
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents import Document
+from qdrant_client import QdrantClient
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = int(os.getenv("RAG_HNSW_EF", "128"))
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# ---------------------------------------------------------
+# Export
+# ---------------------------------------------------------
+def export_snapshot(qdrant_url: str, collection: str, out_dir: str, vector_name: str = None,
+                    build_hnsw: bool = False, batch_size: int = 512) -> int:
+    """
+    Scrolls the whole collection into a snapshot directory. vector_name picks
+    one named vector (e.g. "full") on collections that have several.
+    """
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    qdrant = QdrantClient(url=qdrant_url)
+
+    count = qdrant.count(collection_name=collection, exact=True).count
+    dim = None
+    vectors = None
+    offsets = [0]
+    row = 0
+    offset = None
+
+    with open(out / "payloads.jsonl", "wb") as payloads:
+        while True:
+            points, offset = qdrant.scroll(
+                collection_name=collection,
+                limit=batch_size,
+                offset=offset,
+                with_payload=True,
+                with_vectors=[vector_name] if vector_name else True
+            )
+
+            for point in points:
+                # vector_name "" is the unnamed vector of a collection that also has named ones
+                vector = point.vector[vector_name] if vector_name is not None else point.vector
+                if vectors is None:
+                    dim = len(vector)
+                    vectors = np.lib.format.open_memmap(
+                        out / "vectors.npy", mode="w+", dtype=np.float32, shape=(count, dim)
+                    )
+                if row == count: # points added while exporting
+                    break
+
+                vectors[row] = normalize(np.asarray(vector, dtype=np.float32))
+
+                line = json.dumps({
+                    "id": str(point.id),
+                    "page_content": point.payload.get("page_content", ""),
+                    "metadata": point.payload.get("metadata", {})
+                }).encode() + b"\n"
+                payloads.write(line)
+                offsets.append(offsets[-1] + len(line))
+                row += 1
+
+            if offset is None or row == count:
+                break
+
+    if vectors is None:
+        raise ValueError(f"collection {collection} is empty")
+    vectors.flush()
+    np.save(out / "offsets.npy", np.asarray(offsets, dtype=np.int64))
+
+    if build_hnsw:
+        import hnswlib # optional, only needed for the hnsw backend
+
+        index = hnswlib.Index(space="ip", dim=dim)
+        index.init_index(max_elements=row, M=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION)
+        index.add_items(np.asarray(vectors[:row]), np.arange(row))
+        index.save_index(str(out / "index.hnsw"))
+
+    with open(out / "meta.json", "w") as f:
+        json.dump({"collection": collection, "count": row, "dim": dim, "hnsw": build_hnsw}, f, indent=2)
+
+    return row
+
+
+# ---------------------------------------------------------
+# Stores
+# ---------------------------------------------------------
+class NumpyVectorStore:
+    """
+    Brute-force cosine search: one matrix-vector product over the
+    memory-mapped snapshot. Exact, and fast enough up to ~100k chunks.
+    """
+
+    def __init__(self, embedding, snapshot_dir: str):
+        self.embedding = embedding
+        self.path = Path(snapshot_dir)
+
+        with open(self.path / "meta.json") as f:
+            self.meta = json.load(f)
+        self.count = self.meta["count"]
+
+        self.vectors = np.load(self.path / "vectors.npy", mmap_mode="r")[:self.count]
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+
+        with open(self.path / "payloads.jsonl", "rb") as f:
+            self.payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def payload(self, row: int) -> dict:
+        return json.loads(self.payloads[self.offsets[row]:self.offsets[row + 1]])
+
+    def search_by_vector(self, vector, k: int = 4) -> list:
+        """
+        Returns [(row, score)] of the k nearest rows, best first.
+        """
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def documents(self, hits: list) -> list:
+        documents = []
+        for row, _ in hits:
+            payload = self.payload(row)
+            documents.append(Document(page_content=payload["page_content"], metadata=payload["metadata"]))
+        return documents
+
+    def similarity_search(self, query: str, k: int = 4, search_params=None) -> list:
+        return self.documents(self.search_by_vector(self.embedding.embed_query(query), k))
+
+    async def asimilarity_search(self, query: str, k: int = 4, search_params=None) -> list:
+        # the search itself is in-process and takes microseconds, only the embedding awaits
+        return self.documents(self.search_by_vector(await self.embedding.aembed_query(query), k))
+
+    def similarity_search_batch(self, queries: list, k: int = 4, search_params=None) -> list:
+        unique = list(dict.fromkeys(queries))
+        vectors = dict(zip(unique, self.embedding.embed_documents(unique)))
+        return [self.documents(self.search_by_vector(vectors[query], k)) for query in queries]
+
+    async def asimilarity_search_batch(self, queries: list, k: int = 4, search_params=None) -> list:
+        unique = list(dict.fromkeys(queries))
+        vectors = dict(zip(unique, await self.embedding.aembed_documents(unique)))
+        return [self.documents(self.search_by_vector(vectors[query], k)) for query in queries]
+
+
+class HnswVectorStore(NumpyVectorStore):
+    """
+    Approximate search with an HNSW graph (hnswlib) for collections too big
+    to scan on every question. Payloads still come from the mmap'd snapshot.
+    """
+
+    def __init__(self, embedding, snapshot_dir: str, ef: int = HNSW_EF_SEARCH):
+        super().__init__(embedding, snapshot_dir)
+
+        import hnswlib # optional, only needed for the hnsw backend
+
+        self.index = hnswlib.Index(space="ip", dim=self.meta["dim"])
+        self.index.load_index(str(self.path / "index.hnsw"), max_elements=self.count)
+        self.index.set_ef(max(ef, 1))
+
+    def search_by_vector(self, vector, k: int = 4) -> list:
+        query = normalize(np.asarray(vector, dtype=np.float32))
+        labels, distances = self.index.knn_query(query, k=min(k, self.count))
+        # "ip" distance is 1 - inner product
+        return [(int(row), 1.0 - float(distance)) for row, distance in zip(labels[0], distances[0])]
@@ -0,0 +1,275 @@
+"""
+retrieval.py
+
+Query-side retrieval settings shared by rag-01/rag.py and rag-02/worker.py.
+Configured through environment variables (.env), so both scripts always
+search the collection the same way the indexer built it.
+
+- RAG_COLLECTION / QDRANT_URL          which collection to search
+- RAG_QUANTIZATION_OVERSAMPLING/RESCORE quantized search (indexing.py --quantization)
+- RAG_SHORT_DIMENSIONS                 two-stage search (indexing.py --short-dimensions)
+- RAG_SHORT_CANDIDATES                 candidates per result fetched by the short vector
+- RAG_HYBRID                           BM25 + dense with RRF fusion (indexing.py --hybrid)
+- RAG_HYBRID_CANDIDATES                candidates per result from each of the two searches
+- RAG_VECTOR_BACKEND                   qdrant | numpy | hnsw (local snapshot, no network)
+- RAG_SNAPSHOT_DIR                     snapshot written by rag-01/export_snapshot.py
+"""
+
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from qdrant_client import AsyncQdrantClient, QdrantClient, models
+
+from bm25 import sparse_query
+from local_vector_store import HnswVectorStore, NumpyVectorStore
+
+load_dotenv()
+
+# ---------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+COLLECTION_NAME = os.getenv("RAG_COLLECTION", "ansible_vectors")
+
+OVERSAMPLING = float(os.getenv("RAG_QUANTIZATION_OVERSAMPLING", "2.0"))
+RESCORE = os.getenv("RAG_QUANTIZATION_RESCORE", "true").lower() == "true"
+
+SHORT_DIMENSIONS = int(os.getenv("RAG_SHORT_DIMENSIONS", "0"))
+SHORT_CANDIDATES = int(os.getenv("RAG_SHORT_CANDIDATES", "8"))
+
+HYBRID = os.getenv("RAG_HYBRID", "false").lower() == "true"
+HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "5"))
+
+VECTOR_BACKEND = os.getenv("RAG_VECTOR_BACKEND", "qdrant")
+SNAPSHOT_DIR = os.getenv("RAG_SNAPSHOT_DIR", str(Path(__file__).resolve().parents[1] / "rag-01" / "snapshot"))
+
+FULL_VECTOR = "full"
+SHORT_VECTOR = "short"
+SPARSE_VECTOR = "bm25"
+
+
+# ---------------------------------------------------------
+# Quantization (see rag-01/indexing.py --quantization)
+# ---------------------------------------------------------
+def search_params(oversampling: float = OVERSAMPLING, rescore: bool = RESCORE) -> models.SearchParams:
+    """
+    Search over the quantized vectors, fetch oversampling * k candidates and
+    rescore them with the full-precision vectors. Qdrant ignores this on
+    collections without quantization.
+    """
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(
+            ignore=False,
+            rescore=rescore,
+            oversampling=oversampling
+        )
+    )
+
+
+# ---------------------------------------------------------
+# Reduced dimensions
+# ---------------------------------------------------------
+def shorten(vector, dimensions: int) -> list:
+    """
+    text-embedding-3 vectors can be cut to their first N dimensions and
+    re-normalized - the same thing the API's `dimensions` parameter does,
+    so one full embedding gives both the short and the full vector.
+    """
+    short = np.asarray(vector[:dimensions], dtype=np.float32)
+    return (short / np.linalg.norm(short)).tolist()
+
+
+def to_documents(points: list) -> list:
+    return [
+        Document(
+            page_content=point.payload["page_content"],
+            metadata=point.payload.get("metadata", {})
+        )
+        for point in points
+    ]
+
+
+# ---------------------------------------------------------
+# Qdrant stores - one query_points call per question, sync or async
+# ---------------------------------------------------------
+class QdrantSearchStore(ABC):
+    """
+    Base for the Qdrant stores below: similarity_search for the scripts,
+    asimilarity_search (async embeddings + AsyncQdrantClient) for services
+    and the async worker. Subclasses only build the query_points arguments.
+    """
+
+    def __init__(self, embedding, collection_name: str = COLLECTION_NAME, url: str = QDRANT_URL):
+        self.embedding = embedding
+        self.collection_name = collection_name
+        self.client = QdrantClient(url=url)
+        self.async_client = AsyncQdrantClient(url=url)
+
+    @abstractmethod
+    def query_args(self, query: str, full: list, k: int, search_params) -> dict:
+        """
+        query_points arguments (query, using, prefetch, limit, search_params)
+        for one question and its full embedding.
+        """
+
+    def query_requests(self, queries: list, vectors: list, k: int, search_params) -> list:
+        requests = []
+        for query, full in zip(queries, vectors):
+            args = self.query_args(query, full, k, search_params)
+            # QueryRequest calls query_points' search_params "params"
+            if "search_params" in args:
+                args["params"] = args.pop("search_params")
+            requests.append(models.QueryRequest(with_payload=True, **args))
+        return requests
+
+    def similarity_search(self, query: str, k: int = 4, search_params=None) -> list:
+        full = self.embedding.embed_query(query)
+        res = self.client.query_points(
+            collection_name=self.collection_name,
+            with_payload=True,
+            **self.query_args(query, full, k, search_params)
+        )
+        return to_documents(res.points)
+
+    async def asimilarity_search(self, query: str, k: int = 4, search_params=None) -> list:
+        full = await self.embedding.aembed_query(query)
+        res = await self.async_client.query_points(
+            collection_name=self.collection_name,
+            with_payload=True,
+            **self.query_args(query, full, k, search_params)
+        )
+        return to_documents(res.points)
+
+    def similarity_search_batch(self, queries: list, k: int = 4, search_params=None) -> list:
+        """
+        One embeddings request and one query_batch_points call for many
+        questions. Returns one document list per question, in order.
+        """
+        unique = list(dict.fromkeys(queries))
+        vectors = self.embedding.embed_documents(unique)
+        res = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=self.query_requests(unique, vectors, k, search_params)
+        )
+        found = {query: to_documents(r.points) for query, r in zip(unique, res)}
+        return [found[query] for query in queries]
+
+    async def asimilarity_search_batch(self, queries: list, k: int = 4, search_params=None) -> list:
+        unique = list(dict.fromkeys(queries))
+        vectors = await self.embedding.aembed_documents(unique)
+        res = await self.async_client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=self.query_requests(unique, vectors, k, search_params)
+        )
+        found = {query: to_documents(r.points) for query, r in zip(unique, res)}
+        return [found[query] for query in queries]
+
+
+class DenseVectorStore(QdrantSearchStore):
+    """
+    The default layout: one unnamed full vector per chunk.
+    """
+
+    def query_args(self, query, full, k, search_params):
+        return {"query": full, "limit": k, "search_params": search_params}
+
+
+class TwoStageVectorStore(QdrantSearchStore):
+    """
+    similarity_search over a collection with a small "short" vector (kept in
+    RAM) and the "full" vector (kept on disk). Qdrant finds k * candidates
+    with the short vector, then rescores only those with the full vector.
+    """
+
+    def __init__(self, embedding, collection_name: str = COLLECTION_NAME, url: str = QDRANT_URL,
+                 short_dimensions: int = SHORT_DIMENSIONS, candidates: int = SHORT_CANDIDATES):
+        super().__init__(embedding, collection_name, url)
+        self.short_dimensions = short_dimensions
+        self.candidates = candidates
+
+    def query_args(self, query, full, k, search_params):
+        return {
+            "prefetch": models.Prefetch(
+                query=shorten(full, self.short_dimensions),
+                using=SHORT_VECTOR,
+                limit=k * self.candidates,
+                params=search_params
+            ),
+            "query": full,
+            "using": FULL_VECTOR,
+            "limit": k
+        }
+
+
+# ---------------------------------------------------------
+# Hybrid BM25 + dense (see common/bm25.py)
+# ---------------------------------------------------------
+class HybridVectorStore(QdrantSearchStore):
+    """
+    Runs the dense search (single- or two-stage) and the BM25 search inside
+    one Qdrant query and merges both rankings with reciprocal-rank fusion,
+    so exact module names and flags are found even when the dense vector
+    ranks them low.
+    """
+
+    def __init__(self, embedding, collection_name: str = COLLECTION_NAME, url: str = QDRANT_URL,
+                 short_dimensions: int = SHORT_DIMENSIONS, candidates: int = HYBRID_CANDIDATES):
+        super().__init__(embedding, collection_name, url)
+        self.short_dimensions = short_dimensions
+        self.candidates = candidates
+
+    def dense_prefetch(self, full: list, limit: int, search_params) -> models.Prefetch:
+        if not self.short_dimensions:
+            return models.Prefetch(query=full, limit=limit, params=search_params)
+
+        return models.Prefetch(
+            prefetch=models.Prefetch(
+                query=shorten(full, self.short_dimensions),
+                using=SHORT_VECTOR,
+                limit=limit * SHORT_CANDIDATES,
+                params=search_params
+            ),
+            query=full,
+            using=FULL_VECTOR,
+            limit=limit
+        )
+
+    def query_args(self, query, full, k, search_params):
+        limit = k * self.candidates
+        return {
+            "prefetch": [
+                self.dense_prefetch(full, limit, search_params),
+                models.Prefetch(query=sparse_query(query), using=SPARSE_VECTOR, limit=limit)
+            ],
+            "query": models.FusionQuery(fusion=models.Fusion.RRF),
+            "limit": k
+        }
+
+
+# ---------------------------------------------------------
+# Connect to the vector DB the way the collection was indexed
+# ---------------------------------------------------------
+def connect_vector_db(embedding, backend: str = VECTOR_BACKEND, hybrid: bool = HYBRID):
+    if hybrid and backend != "qdrant":
+        raise ValueError("RAG_HYBRID needs RAG_VECTOR_BACKEND=qdrant, the BM25 index lives in Qdrant")
+
+    if backend == "numpy":
+        return NumpyVectorStore(embedding, SNAPSHOT_DIR)
+
+    if backend == "hnsw":
+        return HnswVectorStore(embedding, SNAPSHOT_DIR)
+
+    if backend != "qdrant":
+        raise ValueError(f"unknown RAG_VECTOR_BACKEND: {backend}")
+
+    if hybrid:
+        return HybridVectorStore(embedding)
+
+    if SHORT_DIMENSIONS:
+        return TwoStageVectorStore(embedding)
+
+    return DenseVectorStore(embedding)
@@ -1,11 +1,17 @@
 # server.py
 
+import sys
+from pathlib import Path
+
 from mcp.server.fastmcp import FastMCP
 import requests
 import wikipedia
 from qdrant_client import QdrantClient
 from openai import OpenAI
 
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from embedding_cache import cached_embeddings
+
 # -----------------------------
 # MCP SERVER
 # -----------------------------
@@ -43,12 +49,7 @@ def qdrant_search(
     embedding_model: str = "text-embedding-3-small"
 ) -> str:
 
-    emb = openai_client.embeddings.create(
-        model=embedding_model,
-        input=query
-    )
-
-    vector = emb.data[0].embedding
+    vector = cached_embeddings(openai_client, embedding_model, [query])[0]
 
     qdrant = QdrantClient(url=qdrant_url)
 
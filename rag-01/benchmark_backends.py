@@ -0,0 +1,94 @@
+"""
+benchmark_backends.py
+
+Compares retrieval latency of Qdrant (network round trip) with the
+in-process numpy and hnsw backends on the exported snapshot.
+Recall@k is measured against the exact numpy search.
+
+Run (after python export_snapshot.py --hnsw):
+python benchmark_backends.py --queries 500 --k 4
+python benchmark_backends.py --questions questions.txt
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient
+
+from benchmark_quantization import load_queries, percentile, recall_at_k
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from local_vector_store import HnswVectorStore, NumpyVectorStore
+from retrieval import COLLECTION_NAME, FULL_VECTOR, QDRANT_URL, SHORT_DIMENSIONS, SNAPSHOT_DIR, search_params
+
+load_dotenv()
+
+
+def timed_searches(search, queries: list) -> tuple:
+    results = []
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, latencies
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Qdrant vs in-process retrieval benchmark")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--snapshot", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    numpy_store = NumpyVectorStore(None, args.snapshot)
+    print(f"numpy snapshot loaded in {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"({numpy_store.count} chunks)")
+
+    stores = {"numpy": numpy_store}
+    try:
+        started = time.perf_counter()
+        stores["hnsw"] = HnswVectorStore(None, args.snapshot)
+        print(f"hnsw index loaded in {(time.perf_counter() - started) * 1000:.1f} ms")
+    except (ImportError, RuntimeError) as e:
+        print(f"hnsw backend skipped: {e}")
+
+    # real questions, or stored chunks as query vectors
+    if args.questions:
+        queries = load_queries(None, args.queries, args.questions)
+    else:
+        rows = random.sample(range(numpy_store.count), min(args.queries, numpy_store.count))
+        queries = [numpy_store.vectors[row].tolist() for row in rows]
+
+    # ids instead of rows, so Qdrant results are comparable
+    def local_search(store):
+        return lambda query: [store.payload(row)["id"] for row, _ in store.search_by_vector(query, args.k)]
+
+    qdrant = QdrantClient(url=QDRANT_URL)
+
+    def qdrant_search(query):
+        res = qdrant.query_points(
+            collection_name=COLLECTION_NAME,
+            query=query,
+            using=FULL_VECTOR if SHORT_DIMENSIONS else None,
+            limit=args.k,
+            search_params=search_params()
+        )
+        return [str(point.id) for point in res.points]
+
+    truth, _ = timed_searches(local_search(numpy_store), queries)
+
+    print(f"\n{'backend':<8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+
+    backends = {"qdrant": qdrant_search, **{name: local_search(store) for name, store in stores.items()}}
+    for name, search in backends.items():
+        results, latencies = timed_searches(search, queries)
+        print(f"{name:<8} {recall_at_k(results, truth, args.k):>9.3f} "
+              f"{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.95):>8.2f}")
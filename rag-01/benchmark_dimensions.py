@@ -0,0 +1,155 @@
+"""
+benchmark_dimensions.py
+
+Compares the current setup (one full 3072-dim vector per chunk) with
+reduced-dimension layouts (indexing.py --short-dimensions N):
+
+- short:     search the short vector only
+- two-stage: short vector finds k * candidates, full vector rescores them
+
+Reports recall@k against an exact full-vector search, p50 / p95 latency
+and RAM per vector (the full vector stays on disk in the reduced layouts).
+
+Run:
+python benchmark_dimensions.py --dimensions 256 512 1024 --candidates 8
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from qdrant_client import QdrantClient, models
+
+from benchmark_quantization import (
+    full_vector, load_points, load_queries, percentile, recall_at_k, run_queries, wait_until_indexed
+)
+from indexing import COLLECTION_NAME, QDRANT_URL, VECTOR_SIZE, ensure_collection
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from retrieval import FULL_VECTOR, SHORT_VECTOR, shorten
+
+load_dotenv()
+
+
+# ---------------------------------------------------------
+# Copy of the sample with a given short dimension (0 = current layout)
+# ---------------------------------------------------------
+def build_copy(qdrant: QdrantClient, short_dimensions: int, points: list) -> str:
+    collection = f"{COLLECTION_NAME}_bench_dims_{short_dimensions}"
+
+    if qdrant.collection_exists(collection):
+        qdrant.delete_collection(collection)
+    ensure_collection(qdrant, "none", collection=collection, short_dimensions=short_dimensions, hybrid=False)
+
+    for start in range(0, len(points), 256):
+        batch = points[start:start + 256]
+        qdrant.upsert(
+            collection_name=collection,
+            points=[
+                models.PointStruct(
+                    id=point.id,
+                    vector=full_vector(point) if not short_dimensions else {
+                        FULL_VECTOR: full_vector(point),
+                        SHORT_VECTOR: shorten(full_vector(point), short_dimensions)
+                    },
+                    payload=point.payload
+                )
+                for point in batch
+            ]
+        )
+
+    wait_until_indexed(qdrant, collection)
+    return collection
+
+
+# ---------------------------------------------------------
+# Query modes
+# ---------------------------------------------------------
+def run_short(qdrant, collection, queries, k, dimensions):
+    return run_named(qdrant, collection, [shorten(q, dimensions) for q in queries], k, SHORT_VECTOR)
+
+
+def run_named(qdrant, collection, queries, k, using):
+    results = []
+    latencies = []
+    for query in queries:
+        ids, ms = timed(lambda: qdrant.query_points(collection_name=collection, query=query, using=using, limit=k))
+        results.append(ids)
+        latencies.append(ms)
+    return results, latencies
+
+
+def run_two_stage(qdrant, collection, queries, k, dimensions, candidates):
+    results = []
+    latencies = []
+    for query in queries:
+        ids, ms = timed(lambda: qdrant.query_points(
+            collection_name=collection,
+            prefetch=models.Prefetch(query=shorten(query, dimensions), using=SHORT_VECTOR, limit=k * candidates),
+            query=query,
+            using=FULL_VECTOR,
+            limit=k
+        ))
+        results.append(ids)
+        latencies.append(ms)
+    return results, latencies
+
+
+def timed(search):
+    started = time.perf_counter()
+    res = search()
+    return [str(point.id) for point in res.points], (time.perf_counter() - started) * 1000
+
+
+def report(name, results, latencies, truth, k, ram_bytes):
+    print(
+        f"{name:<22} {recall_at_k(results, truth, k):>9.3f} "
+        f"{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.95):>8.2f} {ram_bytes:>9} B"
+    )
+
+
+# ---------------------------------------------------------
+# Main
+# ---------------------------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reduced-dimension recall/latency/memory benchmark")
+    parser.add_argument("--points", type=int, default=20_000, help="points copied per layout")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--candidates", type=int, default=8, help="first-pass candidates per result")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark collections")
+    args = parser.parse_args()
+
+    qdrant = QdrantClient(url=QDRANT_URL)
+
+    points = load_points(qdrant, args.points)
+    queries = load_queries(points, args.queries, args.questions)
+    print(f"{len(points)} points, {len(queries)} queries, k={args.k}\n")
+
+    baseline = build_copy(qdrant, 0, points)
+    truth, _ = run_queries(qdrant, baseline, queries, args.k, models.SearchParams(exact=True))
+
+    print(f"{'layout':<22} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'RAM/vector':>11}")
+
+    results, latencies = run_queries(qdrant, baseline, queries, args.k, None)
+    report(f"full {VECTOR_SIZE}", results, latencies, truth, args.k, VECTOR_SIZE * 4)
+
+    for dimensions in args.dimensions:
+        collection = build_copy(qdrant, dimensions, points)
+
+        results, latencies = run_short(qdrant, collection, queries, args.k, dimensions)
+        report(f"short {dimensions}", results, latencies, truth, args.k, dimensions * 4)
+
+        results, latencies = run_two_stage(qdrant, collection, queries, args.k, dimensions, args.candidates)
+        report(f"two-stage {dimensions}", results, latencies, truth, args.k, dimensions * 4)
+
+        if not args.keep:
+            qdrant.delete_collection(collection)
+
+    if not args.keep:
+        qdrant.delete_collection(baseline)
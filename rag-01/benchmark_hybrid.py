@@ -0,0 +1,117 @@
+"""
+benchmark_hybrid.py
+
+Dense-only vs hybrid (BM25 + dense, RRF) retrieval on a labelled question
+set. The collection must have been indexed with --hybrid.
+
+Input JSONL, one question per line, pages as in the chunk metadata:
+{"query": "Which module copies files to remote hosts?", "pages": [41, 42]}
+
+Reports per k:
+- recall@k (share of relevant pages found)
+- tokens of the retrieved chunks, and of the context pack_context() builds
+  from them (what is actually sent to the LLM)
+- p50 / p95 latency of retrieval alone (embed + search) and end to end
+  (embed + search + pack_context)
+
+Embeddings are cached before timing, so "embed" is a local cache read;
+with --uncached every query goes to the embeddings API as a cold query
+would. LLM generation is not included in either number.
+
+Run:
+python benchmark_hybrid.py eval_questions.jsonl --k 1 2 4 8
+python benchmark_hybrid.py eval_questions.jsonl --uncached
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import tiktoken
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+
+from benchmark_quantization import percentile
+from indexing import EMBEDDING_MODEL
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from context import count_tokens, pack_context
+from embedding_cache import CachedEmbeddings
+from retrieval import connect_vector_db, search_params
+
+load_dotenv()
+
+
+def evaluate(vector_db, questions: list, k: int, encoding) -> dict:
+    """
+    Mean recall and token counts, and per-question latencies in ms:
+    "retrieve" is embed + search, "end_to_end" adds pack_context.
+    """
+    recalls = []
+    tokens = []
+    packed_tokens = []
+    retrieve = []
+    end_to_end = []
+
+    for question in questions:
+        started = time.perf_counter()
+        results = vector_db.similarity_search(query=question["query"], k=k, search_params=search_params())
+        retrieved = time.perf_counter()
+        final_context = pack_context(results)
+        packed = time.perf_counter()
+
+        retrieve.append((retrieved - started) * 1000)
+        end_to_end.append((packed - started) * 1000)
+
+        relevant = set(question["pages"])
+        found = {item.metadata.get("page") for item in results}
+        recalls.append(len(relevant & found) / len(relevant))
+        tokens.append(sum(len(encoding.encode(item.page_content)) for item in results))
+        packed_tokens.append(count_tokens(final_context))
+
+    return {
+        "recall": statistics.mean(recalls),
+        "tokens": statistics.mean(tokens),
+        "packed_tokens": statistics.mean(packed_tokens),
+        "retrieve": retrieve,
+        "end_to_end": end_to_end
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Dense vs hybrid retrieval benchmark")
+    parser.add_argument("questions", help="JSONL with query + relevant pages")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--uncached", action="store_true", help="embed every query with the API, as a cold query")
+    args = parser.parse_args()
+
+    with open(args.questions) as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+
+    if args.uncached:
+        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+    else:
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL))
+        embeddings.embed_documents([question["query"] for question in questions]) # warm the cache
+
+    encoding = tiktoken.encoding_for_model("gpt-4o")
+    stores = {
+        "dense": connect_vector_db(embeddings, "qdrant", hybrid=False),
+        "hybrid": connect_vector_db(embeddings, "qdrant", hybrid=True)
+    }
+
+    print(f"{len(questions)} questions, embeddings {'from the API' if args.uncached else 'cached'}, "
+          f"latencies without LLM generation\n")
+    print(f"{'mode':<8} {'k':>3} {'recall@k':>9} {'ctx tokens':>11} {'packed':>7} "
+          f"{'retr p50':>9} {'retr p95':>9} {'e2e p50':>8} {'e2e p95':>8}")
+
+    for k in args.k:
+        for name, vector_db in stores.items():
+            row = evaluate(vector_db, questions, k, encoding)
+            print(f"{name:<8} {k:>3} {row['recall']:>9.3f} {row['tokens']:>11.0f} {row['packed_tokens']:>7.0f} "
+                  f"{percentile(row['retrieve'], 0.5):>9.2f} {percentile(row['retrieve'], 0.95):>9.2f} "
+                  f"{percentile(row['end_to_end'], 0.5):>8.2f} {percentile(row['end_to_end'], 0.95):>8.2f}")
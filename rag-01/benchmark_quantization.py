@@ -0,0 +1,186 @@
+"""
+benchmark_quantization.py
+
+Compares none / scalar / binary quantization for the ansible_vectors
+collection. Every mode gets its own copy of (a sample of) the collection,
+queries are answered with and without quantization and compared against an
+exact full-precision search on the original collection.
+
+Reports per mode and oversampling factor:
+- recall@k against exact search
+- p50 / p95 search latency
+- RAM per vector (the float32 originals stay on disk for quantized modes)
+
+Run:
+python benchmark_quantization.py --points 20000 --queries 200 --k 10
+python benchmark_quantization.py --questions questions.txt
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from openai import OpenAI
+from qdrant_client import QdrantClient, models
+
+from indexing import COLLECTION_NAME, EMBEDDING_MODEL, QDRANT_URL, VECTOR_SIZE, ensure_collection
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from embedding_cache import cached_embeddings
+from retrieval import FULL_VECTOR, search_params
+
+load_dotenv()
+
+RAM_BYTES_PER_VECTOR = {
+    "none": VECTOR_SIZE * 4,
+    "scalar": VECTOR_SIZE,
+    "binary": VECTOR_SIZE // 8
+}
+
+
+# ---------------------------------------------------------
+# Sample the collection
+# ---------------------------------------------------------
+def full_vector(point) -> list:
+    # named vectors: "full" with --short-dimensions, the unnamed "" next to "bm25" in hybrid mode
+    if isinstance(point.vector, dict):
+        return point.vector[FULL_VECTOR] if FULL_VECTOR in point.vector else point.vector[""]
+    return point.vector
+
+
+def load_points(qdrant: QdrantClient, limit: int) -> list:
+    points = []
+    offset = None
+
+    while len(points) < limit:
+        batch, offset = qdrant.scroll(
+            collection_name=COLLECTION_NAME,
+            limit=min(256, limit - len(points)),
+            offset=offset,
+            with_payload=True,
+            with_vectors=True
+        )
+        points.extend(batch)
+        if offset is None:
+            break
+
+    return points
+
+
+def load_queries(points: list, count: int, questions_file: str) -> list:
+    if questions_file:
+        with open(questions_file) as f:
+            questions = [line.strip() for line in f if line.strip()]
+        return cached_embeddings(OpenAI(), EMBEDDING_MODEL, questions[:count])
+
+    # stored chunks as queries - the chunk itself is always one of the true neighbours
+    return [full_vector(point) for point in random.sample(points, min(count, len(points)))]
+
+
+# ---------------------------------------------------------
+# One copy of the collection per mode
+# ---------------------------------------------------------
+def wait_until_indexed(qdrant: QdrantClient, collection: str):
+    while qdrant.get_collection(collection).status != models.CollectionStatus.GREEN:
+        time.sleep(1)
+
+
+def build_copy(qdrant: QdrantClient, mode: str, points: list) -> str:
+    collection = f"{COLLECTION_NAME}_bench_{mode}"
+
+    if qdrant.collection_exists(collection):
+        qdrant.delete_collection(collection)
+    ensure_collection(qdrant, mode, collection=collection, short_dimensions=0, hybrid=False)
+
+    for start in range(0, len(points), 256):
+        qdrant.upsert(
+            collection_name=collection,
+            points=[
+                models.PointStruct(id=point.id, vector=full_vector(point), payload=point.payload)
+                for point in points[start:start + 256]
+            ]
+        )
+
+    wait_until_indexed(qdrant, collection)
+    return collection
+
+
+# ---------------------------------------------------------
+# Measure
+# ---------------------------------------------------------
+def run_queries(qdrant: QdrantClient, collection: str, queries: list, k: int, params) -> tuple:
+    results = []
+    latencies = []
+
+    for query in queries:
+        started = time.perf_counter()
+        res = qdrant.query_points(
+            collection_name=collection,
+            query=query,
+            limit=k,
+            search_params=params
+        )
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([str(point.id) for point in res.points])
+
+    return results, latencies
+
+
+def recall_at_k(results: list, truth: list, k: int) -> float:
+    return statistics.mean(len(set(found) & set(exact)) / k for found, exact in zip(results, truth))
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+# ---------------------------------------------------------
+# Main
+# ---------------------------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Quantization recall/latency benchmark")
+    parser.add_argument("--points", type=int, default=20_000, help="points copied per mode")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark collections")
+    args = parser.parse_args()
+
+    qdrant = QdrantClient(url=QDRANT_URL)
+
+    points = load_points(qdrant, args.points)
+    queries = load_queries(points, args.queries, args.questions)
+    print(f"{len(points)} points, {len(queries)} queries, k={args.k}\n")
+
+    # ground truth: exact full-precision search on the unquantized copy
+    baseline = build_copy(qdrant, "none", points)
+    truth, _ = run_queries(qdrant, baseline, queries, args.k, models.SearchParams(exact=True))
+
+    print(f"{'mode':<8} {'oversampling':>12} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'RAM/vector':>11}")
+
+    for mode in ["none", "scalar", "binary"]:
+        collection = baseline if mode == "none" else build_copy(qdrant, mode, points)
+        factors = [1.0] if mode == "none" else args.oversampling
+
+        for oversampling in factors:
+            results, latencies = run_queries(
+                qdrant, collection, queries, args.k, search_params(oversampling=oversampling)
+            )
+            print(
+                f"{mode:<8} {oversampling:>12.1f} {recall_at_k(results, truth, args.k):>9.3f} "
+                f"{percentile(latencies, 0.5):>8.2f} {percentile(latencies, 0.95):>8.2f} "
+                f"{RAM_BYTES_PER_VECTOR[mode]:>9} B"
+            )
+
+        if not args.keep and collection != baseline:
+            qdrant.delete_collection(collection)
+
+    if not args.keep:
+        qdrant.delete_collection(baseline)
@@ -0,0 +1,266 @@
+"""
+embedding_pipeline.py
+
+Embedding + upsert stage used by indexing.py.
+
+- packs chunks into token-budgeted batches
+- keeps a bounded number of embedding requests in flight
+- backs off on 429s (all requests pause together, the limit is per account)
+- upserts every batch to Qdrant as soon as it has been embedded
+- reuses vectors from the local embedding cache, only misses hit the API
+- pulls chunks lazily (in a thread, so PDF parsing never blocks the event
+  loop), so memory is bounded by max_in_flight batches, not corpus size
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import tiktoken
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
+from qdrant_client import AsyncQdrantClient, models
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from embedding_cache import default_cache
+from bm25 import sparse_document
+from retrieval import FULL_VECTOR, SHORT_VECTOR, SPARSE_VECTOR, shorten
+
+# ---------------------------------------------------------
+# Defaults
+# ---------------------------------------------------------
+MAX_BATCH_TOKENS = 100_000 # API limit is 300k tokens per request
+MAX_BATCH_SIZE = 256 # API limit is 2048 inputs per request
+MAX_IN_FLIGHT = 8
+MAX_RETRIES = 8
+MIN_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+# ---------------------------------------------------------
+# Token-budgeted batching
+# ---------------------------------------------------------
+def token_batches(items, encoding, max_tokens=MAX_BATCH_TOKENS, max_size=MAX_BATCH_SIZE):
+    """
+    Groups (point_id, chunk) pairs into batches that stay under
+    max_tokens and max_size. Yields (batch, token_count).
+    """
+    batch = []
+    batch_tokens = 0
+
+    for point_id, chunk in items:
+        tokens = len(encoding.encode(chunk.page_content))
+
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            yield batch, batch_tokens
+            batch = []
+            batch_tokens = 0
+
+        batch.append((point_id, chunk))
+        batch_tokens += tokens
+
+    if batch:
+        yield batch, batch_tokens
+
+
+# ---------------------------------------------------------
+# Shared rate-limit backoff
+# ---------------------------------------------------------
+class Backoff:
+    """
+    Every 429 doubles the pause (or uses Retry-After when the API sends it)
+    and every success halves it again, so the pipeline settles just under
+    the account's rate limit. Connection errors and 5xx responses back
+    off the same way, the client itself does not retry.
+    """
+
+    def __init__(self):
+        self.delay = 0.0
+        self.resume_at = 0.0
+
+    async def wait(self):
+        pause = self.resume_at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    def rate_limited(self, error: Exception):
+        response = getattr(error, "response", None) # connection errors have none
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        self.delay = min(max(self.delay * 2, MIN_BACKOFF), MAX_BACKOFF)
+        if retry_after:
+            self.delay = max(self.delay, float(retry_after))
+        self.resume_at = max(self.resume_at, time.monotonic() + self.delay)
+
+    def succeeded(self):
+        self.delay /= 2
+        if self.delay < MIN_BACKOFF:
+            self.delay = 0.0
+
+
+# ---------------------------------------------------------
+# Throughput report
+# ---------------------------------------------------------
+class PipelineStats:
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.chunks = 0
+        self.cached = 0
+        self.tokens = 0
+        self.batches = 0
+        self.rate_limited = 0
+
+    def report(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"{self.chunks} chunks / {self.tokens} tokens in {elapsed:.1f}s "
+            f"({self.chunks / elapsed:.1f} chunks/s, {self.tokens / elapsed:.0f} tokens/s, "
+            f"{self.batches} batches, {self.cached} chunks from cache, "
+            f"{self.rate_limited} rate-limited retries)"
+        )
+
+
+# ---------------------------------------------------------
+# Embed one batch, then upsert it
+# ---------------------------------------------------------
+async def embed_batch(openai_client, backoff, stats, model, texts):
+    for attempt in range(MAX_RETRIES):
+        await backoff.wait()
+        try:
+            response = await openai_client.embeddings.create(model=model, input=texts)
+        except (RateLimitError, APIConnectionError, InternalServerError) as error:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            stats.rate_limited += isinstance(error, RateLimitError)
+            backoff.rate_limited(error)
+            continue
+
+        backoff.succeeded()
+        return [item.embedding for item in response.data]
+
+
+def point_vector(vector, text: str, short_dimensions: int, hybrid: bool):
+    full = vector.tolist() if hasattr(vector, "tolist") else vector
+    if not short_dimensions and not hybrid:
+        return full
+
+    if short_dimensions:
+        vectors = {FULL_VECTOR: full, SHORT_VECTOR: shorten(full, short_dimensions)}
+    else:
+        vectors = {"": full}
+    if hybrid:
+        vectors[SPARSE_VECTOR] = sparse_document(text)
+    return vectors
+
+
+async def process_batch(openai_client, qdrant, backoff, stats, model, collection, batch, batch_tokens,
+                        short_dimensions, hybrid, on_batch_done):
+    texts = [chunk.page_content for _, chunk in batch]
+
+    cache = default_cache()
+    vectors = cache.get_many(model, None, texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    stats.cached += len(texts) - len(missing)
+
+    if missing:
+        fresh = await embed_batch(openai_client, backoff, stats, model, [texts[i] for i in missing])
+        # takes a file lock and fsyncs, keep it off the event loop
+        await asyncio.to_thread(cache.put_many, model, None, [texts[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+
+    await qdrant.upsert(
+        collection_name=collection,
+        points=[
+            models.PointStruct(
+                id=point_id,
+                vector=point_vector(vector, chunk.page_content, short_dimensions, hybrid),
+                payload={
+                    "page_content": chunk.page_content,
+                    "metadata": chunk.metadata
+                }
+            )
+            for (point_id, chunk), vector in zip(batch, vectors)
+        ]
+    )
+
+    stats.chunks += len(batch)
+    stats.tokens += batch_tokens
+    stats.batches += 1
+
+    if on_batch_done:
+        # may do blocking I/O (the indexer deletes stale points and saves its manifest)
+        await asyncio.to_thread(on_batch_done, batch)
+
+
+# ---------------------------------------------------------
+# Pipeline
+# ---------------------------------------------------------
+async def embed_and_upsert(
+    items,
+    qdrant_url: str,
+    collection: str,
+    model: str,
+    max_in_flight: int = MAX_IN_FLIGHT,
+    max_batch_tokens: int = MAX_BATCH_TOKENS,
+    short_dimensions: int = 0,
+    hybrid: bool = False,
+    on_batch_done=None
+) -> PipelineStats:
+    """
+    Embeds and upserts an iterable of (point_id, chunk) pairs.
+    At most max_in_flight batches are being embedded/upserted at any time,
+    and the next batch is only read from items once a slot is free.
+    With short_dimensions, every point gets a "short" and a "full" vector,
+    with hybrid also a BM25 sparse vector.
+    on_batch_done(batch) is called in a worker thread after each batch has
+    been upserted.
+    """
+    encoding = tiktoken.encoding_for_model(model)
+    # no retries inside the client: every 429 has to reach the shared Backoff in embed_batch
+    openai_client = AsyncOpenAI(max_retries=0)
+    qdrant = AsyncQdrantClient(url=qdrant_url)
+
+    backoff = Backoff()
+    stats = PipelineStats()
+    slots = asyncio.Semaphore(max_in_flight)
+    pending = set()
+
+    async def run(batch, batch_tokens):
+        try:
+            await process_batch(
+                openai_client, qdrant, backoff, stats,
+                model, collection, batch, batch_tokens, short_dimensions, hybrid, on_batch_done
+            )
+        finally:
+            slots.release()
+
+    batches = token_batches(items, encoding, max_batch_tokens)
+
+    try:
+        while True:
+            await slots.acquire()
+
+            next_batch = await asyncio.to_thread(next, batches, None)
+            if next_batch is None:
+                slots.release()
+                break
+            batch, batch_tokens = next_batch
+
+            # surface failures as soon as they happen instead of at the end
+            for task in [task for task in pending if task.done()]:
+                pending.discard(task)
+                task.result()
+
+            pending.add(asyncio.create_task(run(batch, batch_tokens)))
+
+        await asyncio.gather(*pending)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        raise
+    finally:
+        await qdrant.close()
+        await openai_client.close()
+
+    return stats
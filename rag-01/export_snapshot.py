@@ -0,0 +1,48 @@
+"""
+export_snapshot.py
+
+Exports the ansible_vectors collection into a local snapshot for the
+in-process numpy / hnsw backends (RAG_VECTOR_BACKEND in .env).
+Re-run it after indexing.py to pick up new chunks.
+
+Run:
+python export_snapshot.py                 # numpy backend
+python export_snapshot.py --hnsw          # also build the HNSW graph (pip install hnswlib)
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from local_vector_store import export_snapshot
+from retrieval import COLLECTION_NAME, FULL_VECTOR, HYBRID, QDRANT_URL, SHORT_DIMENSIONS, SNAPSHOT_DIR
+
+load_dotenv()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Export the collection for local search")
+    parser.add_argument("--out", default=SNAPSHOT_DIR, help="snapshot directory")
+    parser.add_argument("--hnsw", action="store_true", help="also build an HNSW graph")
+    args = parser.parse_args()
+
+    # the dense vector: "full" next to "short", or the unnamed one next to "bm25"
+    if SHORT_DIMENSIONS:
+        vector_name = FULL_VECTOR
+    else:
+        vector_name = "" if HYBRID else None
+
+    started = time.perf_counter()
+    rows = export_snapshot(
+        QDRANT_URL,
+        COLLECTION_NAME,
+        args.out,
+        vector_name=vector_name,
+        build_hnsw=args.hnsw
+    )
+
+    print(f"Exported {rows} chunks to {args.out} in {time.perf_counter() - started:.1f}s")
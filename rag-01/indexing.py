@@ -1,8 +1,26 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
 from dotenv import load_dotenv
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import QdrantVectorStore
+from qdrant_client import QdrantClient, models
+
+from embedding_pipeline import embed_and_upsert
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from retrieval import FULL_VECTOR, HYBRID, SHORT_DIMENSIONS, SHORT_VECTOR, SPARSE_VECTOR
 
 # ENVIRONMENT SETUP
 
@@ -11,33 +29,468 @@ load_dotenv()
 # CONFIGURATION
 
 PDF_FILE = "data.pdf"
-QDRANT_URL = "http://localhost:6333"
-COLLECTION_NAME = "ansible_vectors"
+QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+COLLECTION_NAME = os.getenv("RAG_COLLECTION", "ansible_vectors")
 EMBEDDING_MODEL = "text-embedding-3-large"
+VECTOR_SIZE = 3072 # text-embedding-3-large
+MAX_IN_FLIGHT = 8 # concurrent embedding requests
+MAX_BATCH_TOKENS = 32_000 # tokens per embedding request, keeps batches small in memory
+MANIFEST_FILE = ".index_manifest.json" # finished files, lets a crashed run resume
+SOURCE_ROOT = os.path.dirname(os.path.abspath(__file__)) # sources are stored relative to rag-01/
+
+# SOURCE NAMES - data.pdf, ./data.pdf AND /abs/path/rag-01/data.pdf ARE THE SAME FILE
+
+def source_name(path: str) -> str:
+    return os.path.relpath(os.path.realpath(path), SOURCE_ROOT)
+
+
+# CHUNK IDS - SAME CONTENT + SAME SOURCE ALWAYS GIVES THE SAME POINT ID
+
+def chunk_id(source: str, content: str) -> str:
+    digest = hashlib.sha256(f"{source}\0{content}".encode()).hexdigest()
+    return str(uuid.UUID(digest[:32]))
+
+
+# QUANTIZATION - KEEP A COMPRESSED COPY OF EVERY VECTOR IN RAM
+# scalar: int8, 4x smaller - binary: 1 bit per dimension, 32x smaller
+# the float32 originals move to disk and are only read to rescore candidates
+
+QUANTIZATION_MODES = ["none", "scalar", "binary"]
+
+
+def quantization_config(mode: str):
+    if mode == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True
+            )
+        )
+    if mode == "binary":
+        return models.BinaryQuantization(
+            binary=models.BinaryQuantizationConfig(always_ram=True)
+        )
+    return None
+
+
+# VECTOR LAYOUT
+# default: one unnamed full vector per chunk
+# short_dimensions: a small "short" vector in RAM for the first pass and the
+# "full" vector on disk, only read to rescore the short vector's candidates
+# quantization always applies to the vector used for the first pass
+# hybrid: a "bm25" sparse vector as well, Qdrant keeps its IDF up to date
+
+def vectors_config(short_dimensions: int, quantization: str):
+    quantized = quantization != "none"
+
+    if not short_dimensions:
+        return models.VectorParams(
+            size=VECTOR_SIZE,
+            distance=models.Distance.COSINE,
+            on_disk=quantized,
+            quantization_config=quantization_config(quantization)
+        )
+
+    return {
+        FULL_VECTOR: models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE, on_disk=True),
+        SHORT_VECTOR: models.VectorParams(
+            size=short_dimensions,
+            distance=models.Distance.COSINE,
+            on_disk=quantized,
+            quantization_config=quantization_config(quantization)
+        )
+    }
+
+
+def sparse_vectors_config(hybrid: bool):
+    if not hybrid:
+        return None
+    return {SPARSE_VECTOR: models.SparseVectorParams(modifier=models.Modifier.IDF)}
+
+
+def stored_layout(qdrant: QdrantClient, collection: str) -> tuple:
+    params = qdrant.get_collection(collection).config.params
+    short_dimensions = 0
+    if isinstance(params.vectors, dict) and SHORT_VECTOR in params.vectors:
+        short_dimensions = params.vectors[SHORT_VECTOR].size
+    hybrid = SPARSE_VECTOR in (params.sparse_vectors or {})
+    return short_dimensions, hybrid
+
+
+# CREATE THE COLLECTION ON THE FIRST RUN, SWITCH QUANTIZATION ON LATER RUNS
+
+def ensure_collection(qdrant: QdrantClient, quantization: str = None, collection: str = COLLECTION_NAME,
+                      short_dimensions: int = SHORT_DIMENSIONS, hybrid: bool = HYBRID) -> bool:
+    """
+    Returns True if the collection was created (so nothing is indexed yet).
+    """
+    created = not qdrant.collection_exists(collection)
+    if created:
+        qdrant.create_collection(
+            collection_name=collection,
+            vectors_config=vectors_config(short_dimensions, quantization or "none"),
+            sparse_vectors_config=sparse_vectors_config(hybrid)
+        )
+    else:
+        if stored_layout(qdrant, collection) != (short_dimensions, hybrid):
+            raise SystemExit(
+                f"{collection} was built with a different vector layout, delete it and re-run "
+                f"(vectors come back from the embedding cache, nothing is re-embedded)"
+            )
+
+        if quantization is not None:
+            qdrant.update_collection(
+                collection_name=collection,
+                vectors_config={
+                    SHORT_VECTOR if short_dimensions else "": models.VectorParamsDiff(
+                        on_disk=quantization != "none",
+                        quantization_config=quantization_config(quantization) or models.Disabled.DISABLED
+                    )
+                }
+            )
+
+    # facet and prune_removed need it; collections from before it was added get it here,
+    # creating it again is a no-op
+    qdrant.create_payload_index(
+        collection_name=collection,
+        field_name="metadata.source",
+        field_schema=models.PayloadSchemaType.KEYWORD
+    )
+    return created
+
+
+# IDS ALREADY STORED FOR THIS SOURCE
+
+def existing_ids(qdrant: QdrantClient, source: str) -> set:
+    source_filter = models.Filter(
+        must=[
+            models.FieldCondition(
+                key="metadata.source",
+                match=models.MatchValue(value=source)
+            )
+        ]
+    )
+
+    ids = set()
+    offset = None
+
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=COLLECTION_NAME,
+            scroll_filter=source_filter,
+            limit=1000,
+            offset=offset,
+            with_payload=False,
+            with_vectors=False
+        )
+        ids.update(str(point.id) for point in points)
+        if offset is None:
+            return ids
+
+
+# STREAM CHUNKS PAGE BY PAGE - ONLY ONE PAGE IS IN MEMORY AT A TIME
+
+def iter_chunks(pdf_file: str, text_splitter):
+    loader = PyPDFLoader(file_path=pdf_file)
+
+    source = source_name(pdf_file)
+
+    for page in loader.lazy_load():
+        for chunk in text_splitter.split_documents([page]):
+            chunk.metadata["source"] = source
+            yield chunk_id(source, chunk.page_content), chunk
+
+
+# SPLITTER - SAME SETTINGS FOR STREAMING AND CORPUS MODE
+
+def make_text_splitter():
+    # start_index lets the RAG side merge overlapping neighbours back together
+    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=400, add_start_index=True)
+
+
+# CORPUS MODE - PARSE + CHUNK ONE WHOLE FILE INSIDE A WORKER PROCESS
+
+def parse_file(pdf_file: str):
+    started = time.perf_counter()
+    chunks = list(iter_chunks(pdf_file, make_text_splitter()))
+    return pdf_file, chunks, time.perf_counter() - started
+
+
+def parsed_files(pdf_files: list, workers: int):
+    """
+    Yields parse_file results in order. Only 2 files per worker are parsed
+    ahead of the embedding stage so finished chunks don't pile up in memory.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        remaining = iter(pdf_files)
+        futures = deque()
+
+        for pdf_file in remaining:
+            futures.append(pool.submit(parse_file, pdf_file))
+            if len(futures) >= workers * 2:
+                break
+
+        while futures:
+            result = futures.popleft().result()
+            next_file = next(remaining, None)
+            if next_file is not None:
+                futures.append(pool.submit(parse_file, next_file))
+            yield result
+
+
+# PASS ON ONLY THE CHUNKS THAT ARE NOT STORED YET, REMEMBER EVERY ID SEEN
+
+def new_chunks(chunks, stored: set, seen: set):
+    for point_id, chunk in chunks:
+        if point_id in seen:
+            continue
+        seen.add(point_id)
+        if point_id not in stored:
+            yield point_id, chunk
+
+
+# PROGRESS MANIFEST - FILES THAT WERE FULLY INDEXED, KEYED BY SOURCE NAME
+# only valid for the collection + vector layout it was written for,
+# a manifest of another (or a recreated) collection starts empty
+
+class Manifest:
+
+    def __init__(self, path: str, collection: str, layout: tuple):
+        self.path = path
+        self.collection = collection
+        self.layout = list(layout)
+        self.files = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored.get("collection") == collection and stored.get("layout") == self.layout:
+                self.files = stored["files"]
+
+    def reset(self):
+        self.files = {}
+        self.save()
+
+    def save(self):
+        # write + rename, a crash never leaves a half-written manifest
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"collection": self.collection, "layout": self.layout, "files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, pdf_file: str) -> bool:
+        entry = self.files.get(source_name(pdf_file))
+        stat = os.stat(pdf_file)
+        return bool(entry) and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    def mark_done(self, pdf_file: str, **info):
+        stat = os.stat(pdf_file)
+        self.files[source_name(pdf_file)] = {"size": stat.st_size, "mtime": stat.st_mtime, **info}
+        self.save()
+
+    def forget(self, sources: list):
+        for source in sources:
+            self.files.pop(source, None)
+        self.save()
+
+
+# PER-FILE PROGRESS - A FILE IS DONE ONCE ALL OF ITS NEW CHUNKS ARE UPSERTED
+
+class FileTracker:
+    """
+    Chunks of many files share one embedding stage, so a file only counts as
+    finished when it has been fully read AND its last batch has been upserted.
+    Then its stale points are deleted and it is written to the manifest.
+    Files are tracked by source name, the way chunks refer to them.
+    """
+
+    def __init__(self, qdrant: QdrantClient, manifest: Manifest):
+        self.qdrant = qdrant
+        self.manifest = manifest
+        self.lock = threading.Lock()
+        self.files = {}
+
+    def begin(self, source: str, pdf_file: str, parse_seconds=None):
+        with self.lock:
+            self.files[source] = {
+                "path": pdf_file,
+                "started": time.perf_counter(),
+                "parse_seconds": parse_seconds,
+                "outstanding": 0,
+                "emitted": False
+            }
+
+    def sent(self, source: str):
+        with self.lock:
+            self.files[source]["outstanding"] += 1
+
+    def emitted(self, source: str, total: int, new: int, stale: list):
+        with self.lock:
+            state = self.files[source]
+            state.update(emitted=True, total=total, new=new, stale=stale)
+            finished = state["outstanding"] == 0
+        if finished:
+            self.finish(source)
+
+    def batch_done(self, batch):
+        finished = []
+        with self.lock:
+            for _, chunk in batch:
+                state = self.files[chunk.metadata["source"]]
+                state["outstanding"] -= 1
+                if state["outstanding"] == 0 and state["emitted"]:
+                    finished.append(chunk.metadata["source"])
+        for source in finished:
+            self.finish(source)
+
+    def finish(self, source: str):
+        with self.lock:
+            state = self.files.pop(source)
+
+            if state["stale"]:
+                self.qdrant.delete(
+                    collection_name=COLLECTION_NAME,
+                    points_selector=models.PointIdsList(points=state["stale"])
+                )
+
+            seconds = time.perf_counter() - state["started"]
+            self.manifest.mark_done(
+                state["path"],
+                chunks=state["total"],
+                seconds=round(seconds, 3),
+                parse_seconds=state["parse_seconds"]
+            )
+
+        parsed = f", parsed in {state['parse_seconds']:.2f}s" if state["parse_seconds"] else ""
+        print(f"{source}: {state['total']} chunks ({state['new']} new, "
+              f"{len(state['stale'])} stale) indexed in {seconds:.2f}s{parsed}")
+
+
+# CHUNKS OF ONE FILE, FILTERED AGAINST THE VECTOR DB AND TRACKED
+
+def file_chunks(qdrant: QdrantClient, tracker: FileTracker, pdf_file: str, chunks, parse_seconds=None):
+    source = source_name(pdf_file)
+    stored = existing_ids(qdrant, source)
+    seen = set()
+    new = 0
+
+    tracker.begin(source, pdf_file, parse_seconds)
+    for point_id, chunk in new_chunks(chunks, stored, seen):
+        tracker.sent(source)
+        new += 1
+        yield point_id, chunk
+
+    tracker.emitted(source, total=len(seen), new=new, stale=list(stored - seen))
+
+
+def corpus_chunks(qdrant: QdrantClient, tracker: FileTracker, pdf_files: list, workers: int):
+    # a single file is streamed page by page, many files are parsed in parallel
+    if len(pdf_files) == 1:
+        yield from file_chunks(qdrant, tracker, pdf_files[0], iter_chunks(pdf_files[0], make_text_splitter()))
+        return
+
+    for pdf_file, chunks, parse_seconds in parsed_files(pdf_files, workers):
+        yield from file_chunks(qdrant, tracker, pdf_file, chunks, parse_seconds)
+
+
+# CORPUS MODE - POINTS OF PDFS THAT WERE REMOVED FROM THE DIRECTORY
+
+def indexed_sources(qdrant: QdrantClient) -> list:
+    # distinct metadata.source values, from the keyword payload index
+    response = qdrant.facet(collection_name=COLLECTION_NAME, key="metadata.source", limit=1_000_000, exact=True)
+    return [hit.value for hit in response.hits]
+
+
+def prune_removed(qdrant: QdrantClient, manifest: Manifest, directory: str, pdf_files: list) -> list:
+    """
+    Deletes the points of every source under directory that is not one of
+    pdf_files any more. Returns the removed source names.
+    """
+    prefix = source_name(directory)
+    prefix = "" if prefix == "." else prefix + os.sep
+    present = {source_name(pdf_file) for pdf_file in pdf_files}
+    removed = [
+        source for source in indexed_sources(qdrant)
+        if source.startswith(prefix) and source not in present
+    ]
+    if not removed:
+        return []
+
+    qdrant.delete(
+        collection_name=COLLECTION_NAME,
+        points_selector=models.FilterSelector(
+            filter=models.Filter(
+                must=[models.FieldCondition(key="metadata.source", match=models.MatchAny(any=removed))]
+            )
+        )
+    )
+    manifest.forget(removed)
+    return removed
+
+
+# PDF FILES FOR A FILE, A DIRECTORY OR A GLOB PATTERN
+
+def resolve_pdf_files(target: str) -> list:
+    if os.path.isdir(target):
+        pattern = os.path.join(target, "**", "*.pdf")
+    else:
+        pattern = target
+    return sorted(glob.glob(pattern, recursive=True))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Index PDFs into the vector DB")
+    parser.add_argument("target", nargs="?", default=PDF_FILE, help="PDF file, directory or glob")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help="progress manifest path")
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES,
+                        help="vector quantization for the collection (default: leave as is)")
+    parser.add_argument("--short-dimensions", type=int, default=SHORT_DIMENSIONS,
+                        help="store a short first-pass vector next to the full one (0 = off)")
+    parser.add_argument("--hybrid", action=argparse.BooleanOptionalAction, default=HYBRID,
+                        help="also store BM25 sparse vectors for hybrid search")
+    args = parser.parse_args()
 
-# STEP 1: LOAD THE PDF DOCUMENT
+    # STEP 1: CONNECT TO THE VECTOR DB
 
-loader = PyPDFLoader(file_path=PDF_FILE)
-documents = loader.load()
+    qdrant = QdrantClient(url=QDRANT_URL)
+    created = ensure_collection(qdrant, args.quantization, short_dimensions=args.short_dimensions, hybrid=args.hybrid)
 
-# STEP 2: BREAK PDF INTO CHUNKS
+    # STEP 2: FIND THE FILES, SKIP THE ONES A PREVIOUS RUN ALREADY FINISHED
+    # (a new collection holds nothing yet, whatever the manifest says)
 
-text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=400)
+    pdf_files = resolve_pdf_files(args.target)
+    manifest = Manifest(args.manifest, COLLECTION_NAME, (args.short_dimensions, args.hybrid))
+    if created:
+        manifest.reset()
+    todo = [pdf_file for pdf_file in pdf_files if not manifest.is_done(pdf_file)]
 
-chunked_documents = text_splitter.split_documents(documents) #split_text did not work, we used split_documents
+    print(f"{len(pdf_files)} PDF files, {len(pdf_files) - len(todo)} already indexed")
 
-# STEP 3: CHOOSE MY EMBEDDING MODEL
+    # a directory is the whole corpus - files no longer in it leave the vector DB too
+    if os.path.isdir(args.target):
+        for source in prune_removed(qdrant, manifest, args.target, pdf_files):
+            print(f"{source}: removed from the corpus, its chunks were deleted")
 
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-large")
+    tracker = FileTracker(qdrant, manifest)
 
-# STEP 4: STORE CHUNKS IN VECTOR DB
+    # STEP 3: PARSE + CHUNK THE FILES, EMBED AND STORE ONLY THE NEW CHUNKS
+    # (stale chunks of each file are removed as soon as the file is finished)
 
-qdrant = QdrantVectorStore.from_documents(
-    documents=chunked_documents,
-    embedding=embeddings,
-    url=QDRANT_URL,
-    collection_name=COLLECTION_NAME
-)
+    stats = asyncio.run(
+        embed_and_upsert(
+            corpus_chunks(qdrant, tracker, todo, args.workers),
+            qdrant_url=QDRANT_URL,
+            collection=COLLECTION_NAME,
+            model=EMBEDDING_MODEL,
+            max_in_flight=MAX_IN_FLIGHT,
+            max_batch_tokens=MAX_BATCH_TOKENS,
+            short_dimensions=args.short_dimensions,
+            hybrid=args.hybrid,
+            on_batch_done=tracker.batch_done
+        )
+    )
+    print(stats.report())
 
-print("Documents indexed and stored successfully!")
+    print("Documents indexed and stored successfully!")
@@ -1,46 +1,56 @@
-from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import QdrantVectorStore
-from dotenv import load_dotenv
-from openai import OpenAI 
-
-# ENVIRONMENT SETUP
-load_dotenv()
-client = OpenAI()
-
-
-# EMBEDDING MODEL - SAME AS OF THE VECTOR DB
-
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-large")
-
-# CONNECT TO YOUR VECTOR DB
-
-vector_db = QdrantVectorStore.from_existing_collection(
-    embedding=embeddings,
-    collection_name="ansible_vectors",
-    url="http://localhost:6333",
-)
-
-# ACCEPT THE USER INPUT
+"""
+rag.py
 
-user_query = input("> ")
+Long-running RAG service. Clients (OpenAI, embeddings, vector DB) are
+created once at startup and shared by all requests; answers are streamed
+to the caller token by token as the model generates them.
 
-# SEARCH THE VECTOR DB FOR USER INPUT SIMILARITY SEARCH
+Exposes:
+- /ask?q=...   streamed plain-text answer
+- /health
 
-search_results = vector_db.similarity_search(query=user_query)
+Run:
+uvicorn rag:app --host 0.0.0.0 --port 8000
+curl -N "http://localhost:8000/ask?q=how do I use the copy module"
+"""
 
-context = []
+import sys
+import time
+from pathlib import Path
 
-for item in search_results:
-    block = f"""
-Page Content: {item.page_content}
-Page Number: {item.metadata.get("page","NA")}
-"""
-    context.append(block.strip())
+from dotenv import load_dotenv
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from langchain_openai import OpenAIEmbeddings
+from openai import AsyncOpenAI
 
-final_context = "----\n\n".join(context)
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from embedding_cache import CachedEmbeddings
+from context import pack_context
+from retrieval import connect_vector_db, search_params
 
-SYSTEM_PROMPT = f"""
+# ---------------------------------------------------------
+# ENVIRONMENT SETUP
+# ---------------------------------------------------------
+load_dotenv()
+client = AsyncOpenAI()
+
+# ---------------------------------------------------------
+# EMBEDDING MODEL - SAME AS OF THE VECTOR DB (CACHED LOCALLY, REPEATED QUERIES COST NOTHING)
+# ---------------------------------------------------------
+embeddings = CachedEmbeddings(OpenAIEmbeddings(
+    model="text-embedding-3-large"))
+
+# ---------------------------------------------------------
+# CONNECT TO YOUR VECTOR DB (ONCE, SHARED BY ALL REQUESTS)
+# ---------------------------------------------------------
+vector_db = connect_vector_db(embeddings)
+
+# ---------------------------------------------------------
+# SYSTEM PROMPT
+# ---------------------------------------------------------
+def build_system_prompt(final_context: str) -> str:
+    return f"""
 You are a RAG AI Assistant Chatbot.
 You have been given extracted content from a PDF document:
 The extracted content contains the following:
@@ -62,12 +72,54 @@ Context:
 {final_context}
 """
 
-# GENERATE THE ANSWER USING THE SYSTEM PROMPT AS CONTEXT
+# ---------------------------------------------------------
+# RETRIEVE + GENERATE (STREAMED)
+# ---------------------------------------------------------
+async def answer_stream(user_query: str):
+    started = time.perf_counter()
+
+    # async embeddings + async Qdrant client, other requests keep streaming in the meantime
+    search_results = await vector_db.asimilarity_search(user_query, search_params=search_params())
+    final_context = pack_context(search_results)
+    retrieved = time.perf_counter()
+
+    stream = await client.responses.create(
+        model="gpt-5-nano",
+        instructions=build_system_prompt(final_context),
+        input=user_query,
+        stream=True
+    )
+
+    first_token = None
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            if first_token is None:
+                first_token = time.perf_counter()
+            yield event.delta
+
+    print(
+        f"retrieval {(retrieved - started) * 1000:.0f} ms, "
+        f"first token {((first_token or time.perf_counter()) - started) * 1000:.0f} ms, "
+        f"total {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+# ---------------------------------------------------------
+# FastAPI App
+# ---------------------------------------------------------
+app = FastAPI(title="RAG Service")
+
+
+@app.get("/ask")
+async def ask(q: str):
+    return StreamingResponse(answer_stream(q), media_type="text/plain")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
 
-response = client.responses.create(
-    model="gpt-5-nano",
-    instructions=SYSTEM_PROMPT, 
-    input=user_query
-)
+if __name__ == "__main__":
+    import uvicorn
 
-print(response.output_text)
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,112 @@
+"""
+benchmark_batching.py
+
+Retrieval throughput of the worker with a deep job queue:
+per-job (one embeddings request + one Qdrant query per question, up to
+--concurrency at once) against micro-batched (--batch-size questions per
+embeddings request and per query_batch_points call).
+
+Embeddings are not cached here, otherwise every run after the first would
+only measure the cache. Generation is left out - it is the same per job in
+both modes.
+
+Run:
+python benchmark_batching.py --jobs 512 --concurrency 32 --batch-size 16
+python benchmark_batching.py --questions questions.txt
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from langchain_openai import OpenAIEmbeddings
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from retrieval import connect_vector_db, search_params
+
+load_dotenv()
+
+DEFAULT_QUESTIONS = [
+    "how do I use the copy module",
+    "what does become_user do",
+    "how do I run a playbook in check mode",
+    "how do I loop over a list of items",
+    "where do I define group variables",
+    "how do I template a configuration file",
+    "how do I restart a service with a handler",
+    "what is an inventory file",
+]
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def per_job(vector_db, questions: list, concurrency: int) -> list:
+    slots = asyncio.Semaphore(concurrency)
+    queued = time.perf_counter() # every job is already waiting in the queue
+
+    async def one(question):
+        async with slots:
+            await vector_db.asimilarity_search(question, search_params=search_params())
+            return (time.perf_counter() - queued) * 1000
+
+    return await asyncio.gather(*(one(question) for question in questions))
+
+
+async def batched(vector_db, questions: list, concurrency: int, batch_size: int) -> list:
+    # same number of jobs in flight as per_job, in batch_size groups
+    slots = asyncio.Semaphore(max(concurrency // batch_size, 1))
+    queued = time.perf_counter()
+
+    async def one(batch):
+        async with slots:
+            await vector_db.asimilarity_search_batch(batch, search_params=search_params())
+            return [(time.perf_counter() - queued) * 1000] * len(batch)
+
+    batches = [questions[i:i + batch_size] for i in range(0, len(questions), batch_size)]
+    results = await asyncio.gather(*(one(batch) for batch in batches))
+    return [latency for latencies in results for latency in latencies]
+
+
+async def main(args):
+    vector_db = connect_vector_db(OpenAIEmbeddings(model="text-embedding-3-large"))
+
+    if args.questions:
+        with open(args.questions) as f:
+            pool = [line.strip() for line in f if line.strip()]
+    else:
+        pool = DEFAULT_QUESTIONS
+    # distinct texts, so batching gains nothing from duplicates within a batch
+    questions = [f"{random.choice(pool)} ({i})" for i in range(args.jobs)]
+
+    print(f"{args.jobs} jobs, {args.concurrency} in flight, batches of {args.batch_size}\n")
+    print(f"{'mode':<10} {'jobs/s':>8} {'p50 ms':>9} {'p95 ms':>9}")
+
+    modes = {
+        "per-job": lambda: per_job(vector_db, questions, args.concurrency),
+        "batched": lambda: batched(vector_db, questions, args.concurrency, args.batch_size),
+    }
+    for name, run in modes.items():
+        started = time.perf_counter()
+        latencies = await run()
+        elapsed = time.perf_counter() - started
+        print(f"{name:<10} {len(latencies) / elapsed:>8.1f} "
+              f"{percentile(latencies, 0.5):>9.1f} {percentile(latencies, 0.95):>9.1f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Per-job vs micro-batched retrieval benchmark")
+    parser.add_argument("--jobs", type=int, default=512)
+    parser.add_argument("--questions", help="text file with one question per line")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
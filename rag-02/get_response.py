@@ -1,5 +1,16 @@
-import redis 
+import argparse
+import json
+import sys
 import time
+from itertools import islice
+
+import redis
+
+from job_queue import RESULT_TTL, done_key, response_key, stream_key
+
+WAIT_WINDOW = 256 # pending jobs one BLPOP watches
+SWEEP_SECONDS = 5 # quiet time after which all pending jobs are checked with MGET
+SWEEP_BATCH = 1000 # jobs per MGET of a sweep
 
 redis_client = redis.Redis(
     host="localhost",
@@ -7,13 +18,231 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
-job_id = input("Enter Job ID: ")
+# STREAM THE ANSWER AS THE WORKER GENERATES IT
+
+def stream_response(redis_client, job_id: str, timeout=None):
+    """
+    Yields the answer of a job piece by piece from rag:stream:{job_id}.
+    Blocks until the worker starts (timeout in seconds, None = forever).
+    The generator's return value is the token usage of the answer.
+    """
+    key = stream_key(job_id)
+
+    # already finished and the stream expired - the full answer is still there
+    if not redis_client.exists(key):
+        result = redis_client.get(response_key(job_id))
+        if result is not None:
+            yield result
+            return {}
+
+    last_id = "0"
+    block_ms = int(timeout * 1000) if timeout else 0
+
+    while True:
+        entries = redis_client.xread({key: last_id}, block=block_ms)
+        if not entries:
+            raise TimeoutError(f"no output for job {job_id} after {timeout}s")
+
+        for _, messages in entries:
+            for message_id, fields in messages:
+                last_id = message_id
+
+                if fields["type"] == "delta":
+                    yield fields["text"]
+                elif fields["type"] == "done":
+                    return json.loads(fields["usage"])
+                elif fields["type"] == "error":
+                    raise RuntimeError(fields["error"])
+                elif fields["type"] == "restart":
+                    # the worker died mid-answer, another one starts it over
+                    yield "\n[worker restarted, answer starts over]\n"
+
+
+# WAIT FOR THE FINISHED ANSWER - NO POLLING, THE WORKER PUSHES rag:done:{job_id}
+
+def _take_done(redis_client, key: str, status: str) -> dict:
+    # put the signal back so other clients waiting on the same job wake up too
+    pipe = redis_client.pipeline()
+    pipe.lpush(key, status)
+    pipe.expire(key, RESULT_TTL)
+    pipe.execute()
+
+    status = json.loads(status)
+    if status["status"] == "error":
+        raise RuntimeError(status["error"])
+    return status
+
+
+def wait_for_result(redis_client, job_id: str, timeout: float = 0) -> str:
+    """
+    Blocks until the job is finished and returns the answer
+    (timeout in seconds, 0 = forever).
+    """
+    result = redis_client.get(response_key(job_id))
+    if result is not None:
+        return result
+
+    popped = redis_client.blpop(done_key(job_id), timeout=timeout)
+    if popped is None:
+        raise TimeoutError(f"job {job_id} not finished after {timeout}s")
+
+    key, status = popped
+    _take_done(redis_client, key, status)
+    return redis_client.get(response_key(job_id))
+
+
+def wait_for_results(redis_client, job_ids: list, timeout: float = 0):
+    """
+    Waits for many jobs at once. Yields (job_id, answer) in completion
+    order; already finished jobs come first, from a single MGET.
+    A failed job yields (job_id, RuntimeError).
+
+    BLPOP only watches the WAIT_WINDOW oldest pending jobs, so each wake-up
+    costs the same however many jobs are pending; jobs outside the window
+    that finish first are picked up by an MGET sweep whenever the window
+    has been quiet for SWEEP_SECONDS.
+    """
+    pending = {}
+    for job_id, result in zip(job_ids, redis_client.mget([response_key(job_id) for job_id in job_ids])):
+        if result is None:
+            pending[job_id] = None
+        else:
+            yield job_id, result
+
+    deadline = time.monotonic() + timeout if timeout else None
+
+    while pending:
+        wait = SWEEP_SECONDS
+        if deadline:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"{len(pending)} jobs not finished after {timeout}s")
+            wait = min(wait, remaining)
+
+        window = {done_key(job_id): job_id for job_id in islice(pending, WAIT_WINDOW)}
+        popped = redis_client.blpop(list(window), timeout=max(wait, 0.01))
+
+        if popped is None:
+            # nothing in the window finished lately - look for jobs that did outside it
+            waiting = [{"job_id": job_id} for job_id in pending]
+            for start in range(0, len(waiting), SWEEP_BATCH):
+                finished, _ = fetch_results(redis_client, waiting[start:start + SWEEP_BATCH])
+                for row in finished:
+                    del pending[row["job_id"]]
+                    if row["status"] == "error":
+                        yield row["job_id"], RuntimeError(row["error"])
+                    else:
+                        yield row["job_id"], row["answer"]
+            continue
+
+        key, status = popped
+        job_id = window[key]
+        del pending[job_id]
+        try:
+            _take_done(redis_client, key, status)
+        except RuntimeError as e:
+            yield job_id, e
+            continue
+        yield job_id, redis_client.get(response_key(job_id))
+
+
+# BULK FETCH FOR A PRODUCER MANIFEST - ONE MGET + ONE PIPELINE PER BATCH
+
+def fetch_results(redis_client, items: list) -> tuple:
+    """
+    items: manifest rows {"job_id", ...}. Returns (finished rows with
+    "status" and "answer" or "error", rows still pending).
+    """
+    job_ids = [item["job_id"] for item in items]
+    answers = redis_client.mget([response_key(job_id) for job_id in job_ids])
+
+    # failed jobs have no answer, only an error in their done signal
+    pipe = redis_client.pipeline(transaction=False)
+    for job_id, answer in zip(job_ids, answers):
+        if answer is None:
+            pipe.lindex(done_key(job_id), 0)
+    statuses = iter(pipe.execute())
+
+    finished, pending = [], []
+    for item, answer in zip(items, answers):
+        if answer is not None:
+            finished.append({**item, "status": "ok", "answer": answer})
+            continue
+        status = next(statuses)
+        if status is None:
+            pending.append(item)
+        else:
+            finished.append({**item, "status": "error", "error": json.loads(status).get("error")})
+    return finished, pending
+
+
+def read_manifest(path: str, batch_size: int):
+    batch = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                batch.append(json.loads(line))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+if __name__ == "__main__":
+
+    # python get_response.py --manifest manifest.jsonl --out results.jsonl [--wait]
+    if len(sys.argv) > 1 and sys.argv[1].startswith("--"):
+        parser = argparse.ArgumentParser(description="Collect the answers of a producer.py manifest")
+        parser.add_argument("--manifest", required=True)
+        parser.add_argument("--out", default="results.jsonl")
+        parser.add_argument("--wait", action="store_true", help="wait for unfinished jobs instead of listing them as pending")
+        parser.add_argument("--timeout", type=float, default=0, help="seconds to wait with --wait (0 = forever)")
+        parser.add_argument("--batch-size", type=int, default=1000, help="jobs per round trip")
+        args = parser.parse_args()
+
+        counts = {"ok": 0, "error": 0, "pending": 0}
+        pending = []
+        with open(args.out, "w") as out:
+            for batch in read_manifest(args.manifest, args.batch_size):
+                finished, still_pending = fetch_results(redis_client, batch)
+                for row in finished:
+                    out.write(json.dumps(row) + "\n")
+                    counts[row["status"]] += 1
+                pending += still_pending
+
+            if args.wait and pending:
+                print(f"waiting for {len(pending)} unfinished jobs...")
+                rows = {item["job_id"]: item for item in pending}
+                try:
+                    for job_id, result in wait_for_results(redis_client, list(rows), timeout=args.timeout):
+                        if isinstance(result, Exception):
+                            row = {**rows.pop(job_id), "status": "error", "error": str(result)}
+                        else:
+                            row = {**rows.pop(job_id), "status": "ok", "answer": result}
+                        out.write(json.dumps(row) + "\n")
+                        counts[row["status"]] += 1
+                except TimeoutError as e:
+                    print(e)
+                pending = list(rows.values())
+
+            for item in pending:
+                out.write(json.dumps({**item, "status": "pending"}) + "\n")
+                counts["pending"] += 1
+
+        print(f"{counts['ok']} answered, {counts['error']} failed, {counts['pending']} pending -> {args.out}")
+        sys.exit()
+
+    # python get_response.py JOB_ID [JOB_ID ...]  - wait for finished answers
+    if len(sys.argv) > 1:
+        for job_id, result in wait_for_results(redis_client, sys.argv[1:]):
+            print(f"\n[{job_id}]\n{result}")
+        sys.exit()
+
+    # python get_response.py  - stream one answer as it is generated
+    job_id = input("Enter Job ID: ")
 
-while True:
-    result = redis_client.get(f"rag:response:{job_id}")
-    if result:
-        print(f"Output:\n ")
-        print(result)
-        break
-    print("Waiting to get result")
-    time.sleep(2)
+    print(f"Output:\n ")
+    for text in stream_response(redis_client, job_id):
+        print(text, end="", flush=True)
+    print()
@@ -0,0 +1,591 @@
+"""
+job_queue.py
+
+The rag-02 job queue as Redis Streams read through a consumer group, so
+any number of workers (on any machine) share it and a job only leaves the
+queue once a worker has acknowledged it.
+
+- producers XADD {"job": <json envelope>} to the stream of the job's
+  priority lane, rag:jobs:{interactive|default|bulk}
+- workers XREADGROUP from the "rag-workers" group, lanes in weighted
+  round-robin (LANES), so interactive questions don't wait behind a
+  backfill but bulk jobs still get a share; the entry stays in the group's
+  pending list until the worker XACKs it, in the same transaction that
+  publishes the answer
+- a job past its deadline is answered with an error instead of being run
+- entries pending longer than VISIBILITY_TIMEOUT (worker crashed or hung)
+  are taken over by another worker with XAUTOCLAIM
+- a job that raised (e.g. a transient OpenAI or Qdrant error) goes back to
+  the end of its lane with its delivery count, see retry_or_dead_letter()
+- a job delivered MAX_DELIVERIES times goes to rag:jobs:dead and its
+  waiting clients get an error instead of waiting forever
+
+Also holds the result keys shared by the worker and the clients.
+
+Producers go through AdmissionControl: when the estimated wait of a lane
+(unfinished jobs / drain rate) is over its SLO, new jobs are moved to a
+lower lane or rejected with QueueFull and a retry-after hint. Depth,
+drain rate and estimated waits are published in rag:metrics:queue.
+
+Queue metrics (lag, pending per consumer, queue wait per lane, dead letters):
+python job_queue.py
+"""
+
+import json
+import math
+import os
+import socket
+import time
+
+import redis
+
+# lane -> weight: out of 8 + 3 + 1 reads with all lanes busy, 8 serve interactive
+LANES = {"interactive": 8, "default": 3, "bulk": 1}
+DEFAULT_LANE = "default"
+
+DEAD_STREAM = "rag:jobs:dead"
+GROUP = "rag-workers"
+
+VISIBILITY_TIMEOUT = 300 # seconds a job may stay unacknowledged before another worker takes it
+MAX_DELIVERIES = 3
+CLAIM_INTERVAL = 10 # seconds between checks for stuck jobs
+DEAD_MAXLEN = 10_000
+
+# admission control: estimated queue wait per lane above which new jobs are
+# moved to DOWNGRADE[lane] if that lane is within its own SLO, or rejected
+SLO_SECONDS = {"interactive": 15, "default": 120, "bulk": 3600}
+DOWNGRADE = {"default": "bulk"}
+COLD_START_DEPTH = 1000 # jobs admitted per lane while no worker has finished anything recently (an empty lane takes any batch)
+DRAIN_WINDOW = 60 # seconds of finished jobs the drain rate is averaged over
+METRICS_KEY = "rag:metrics:queue"
+
+WAIT_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10_000, 30_000, 60_000)
+EXPIRED_KEY = "rag:metrics:expired"
+
+RESULT_TTL = 3600 # seconds
+
+
+# ---------------------------------------------------------
+# Result keys
+# ---------------------------------------------------------
+def response_key(job_id: str) -> str:
+    return f"rag:response:{job_id}"
+
+
+def stream_key(job_id: str) -> str:
+    return f"rag:stream:{job_id}"
+
+
+def done_key(job_id: str) -> str:
+    return f"rag:done:{job_id}"
+
+
+def notify_done(pipe, job_id: str, error: str = None):
+    # waiting clients BLPOP rag:done:{job_id} instead of polling
+    status = {"status": "error", "error": error} if error else {"status": "ok"}
+    pipe.lpush(done_key(job_id), json.dumps(status))
+    pipe.expire(done_key(job_id), RESULT_TTL)
+
+
+def notify_failed(pipe, job_id: str, error: str):
+    # let streaming and waiting clients stop waiting
+    pipe.xadd(stream_key(job_id), {"type": "error", "error": error})
+    pipe.expire(stream_key(job_id), RESULT_TTL)
+    notify_done(pipe, job_id, error=error)
+
+
+# ---------------------------------------------------------
+# Lanes
+# ---------------------------------------------------------
+def lane_stream(lane: str) -> str:
+    return f"rag:jobs:{lane}"
+
+
+def wait_key(lane: str) -> str:
+    return f"rag:metrics:wait:{lane}"
+
+
+def wait_bucket(wait_ms: float) -> str:
+    for bound in WAIT_BUCKETS_MS:
+        if wait_ms <= bound:
+            return str(bound)
+    return "inf"
+
+
+class WeightedLanes:
+    """
+    Smooth weighted round-robin over the lanes. order() puts the lane whose
+    turn it is first and the others after it, so an idle lane never leaves a
+    worker idle; served() charges the lane that actually delivered jobs.
+    """
+
+    def __init__(self, weights: dict = LANES):
+        self.weights = weights
+        self.credit = dict.fromkeys(weights, 0)
+
+    def order(self) -> list:
+        return sorted(self.weights, key=lambda lane: self.credit[lane] + self.weights[lane], reverse=True)
+
+    def served(self, lane: str):
+        for name, weight in self.weights.items():
+            self.credit[name] += weight
+        self.credit[lane] -= sum(self.weights.values())
+
+
+# ---------------------------------------------------------
+# Producer side
+# ---------------------------------------------------------
+def enqueue(redis_client, payload: dict) -> str:
+    """
+    payload: the job envelope, at least {"job_id", "query"}, optionally
+    "priority" (a lane), "deadline" (unix time) and "enqueued_at".
+    Works on a client or a pipeline.
+    """
+    lane = payload.get("priority", DEFAULT_LANE)
+    if lane not in LANES:
+        raise ValueError(f"unknown priority {lane!r}, expected one of {', '.join(LANES)}")
+    return redis_client.xadd(lane_stream(lane), {"job": json.dumps(payload)})
+
+
+# ---------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------
+def consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def drained_key(second: int) -> str:
+    return f"rag:metrics:drained:{second}"
+
+
+def ack(pipe, job: dict):
+    # acknowledged entries are deleted too, so the streams only hold unfinished jobs
+    stream = lane_stream(job["lane"])
+    pipe.xack(stream, GROUP, job["entry_id"])
+    pipe.xdel(stream, job["entry_id"])
+    # finished jobs per second, for the drain rate
+    second = drained_key(int(time.time()))
+    pipe.incr(second)
+    pipe.expire(second, DRAIN_WINDOW * 2)
+
+
+def dead_letter(pipe, lane: str, entry_id: str, fields: dict, deliveries: int, reason: str):
+    pipe.xadd(
+        DEAD_STREAM,
+        {**fields, "lane": lane, "entry_id": entry_id, "deliveries": deliveries, "reason": reason},
+        maxlen=DEAD_MAXLEN,
+        approximate=True
+    )
+    pipe.xack(lane_stream(lane), GROUP, entry_id)
+    pipe.xdel(lane_stream(lane), entry_id)
+
+
+def retry_or_dead_letter(pipe, job: dict, error: str) -> bool:
+    """
+    For a job that raised: puts it back at the end of its lane with its
+    delivery count and returns True, or after MAX_DELIVERIES dead-letters
+    it, answers it with the error and returns False.
+    """
+    payload = {
+        name: value for name, value in job.items()
+        if name not in ("entry_id", "lane", "deliveries", "flight")
+    }
+    fields = {"job": json.dumps(payload)}
+
+    if job["deliveries"] >= MAX_DELIVERIES:
+        dead_letter(pipe, job["lane"], job["entry_id"], fields, job["deliveries"], error)
+        notify_failed(pipe, job["job_id"], error)
+        return False
+
+    stream = lane_stream(job["lane"])
+    pipe.xadd(stream, {**fields, "deliveries": job["deliveries"]})
+    pipe.xack(stream, GROUP, job["entry_id"])
+    pipe.xdel(stream, job["entry_id"])
+    return True
+
+
+def expired(job: dict, now: float = None) -> bool:
+    deadline = job.get("deadline")
+    return deadline is not None and (now or time.time()) > deadline
+
+
+def drop_expired(pipe, job: dict):
+    # the client has given up - answer with an error instead of paying for generation
+    notify_failed(pipe, job["job_id"], "deadline exceeded before the answer was generated")
+    ack(pipe, job)
+    pipe.hincrby(EXPIRED_KEY, job["lane"], 1)
+
+
+def lane_messages(response) -> list:
+    # XREADGROUP returns [[stream, [(id, fields), ...]], ...], one item per stream
+    return [(stream.rsplit(":", 1)[1], messages) for stream, messages in response or []]
+
+
+def accept(pipe, lane: str, messages: list, deliveries: dict) -> list:
+    """
+    Turns stream entries of one lane into jobs
+    {"entry_id", "lane", "deliveries", "job_id", "query", ...}.
+    Malformed entries and entries delivered too often are dead-lettered and
+    expired jobs answered with an error on pipe; a job that is run again
+    gets a "restart" entry in its answer stream.
+    """
+    jobs = []
+    now = time.time()
+
+    for entry_id, fields in messages:
+        if fields is None: # deleted while pending
+            pipe.xack(lane_stream(lane), GROUP, entry_id)
+            continue
+
+        # deliveries of this entry + of the entries it was re-queued from
+        count = deliveries.get(entry_id, 1) + int(fields.get("deliveries", 0))
+        try:
+            payload = json.loads(fields["job"])
+            job = {**payload, "job_id": payload["job_id"], "entry_id": entry_id, "lane": lane, "deliveries": count}
+        except (KeyError, TypeError, ValueError) as e:
+            dead_letter(pipe, lane, entry_id, fields, count, f"malformed job: {e}")
+            continue
+
+        if count > MAX_DELIVERIES:
+            error = f"job failed {count - 1} times without finishing"
+            dead_letter(pipe, lane, entry_id, fields, count, error)
+            notify_failed(pipe, job["job_id"], error)
+            continue
+
+        if count == 1 and "enqueued_at" in job:
+            # time spent waiting in the lane (producer and worker clocks are assumed in sync)
+            pipe.hincrby(wait_key(lane), wait_bucket((now - job["enqueued_at"]) * 1000), 1)
+
+        if expired(job, now):
+            drop_expired(pipe, job)
+            continue
+
+        if count > 1:
+            pipe.xadd(stream_key(job["job_id"]), {"type": "restart"})
+            pipe.expire(stream_key(job["job_id"]), RESULT_TTL)
+
+        jobs.append(job)
+    return jobs
+
+
+def delivery_counts(pending: list) -> dict:
+    return {
+        entry["message_id"]: entry["times_delivered"]
+        for entries in pending for entry in entries
+    }
+
+
+class JobQueue:
+    """
+    One consumer of the group. read() hands out stuck jobs of crashed
+    workers first (checked every CLAIM_INTERVAL), then new ones from the
+    lane whose turn it is, falling through to the others when it is empty.
+    """
+
+    def __init__(self, redis_client, consumer: str = None):
+        self.redis = redis_client
+        self.consumer = consumer or consumer_name()
+        self.lanes = WeightedLanes()
+        self.last_claim = 0.0
+
+        for lane in LANES:
+            try:
+                self.redis.xgroup_create(lane_stream(lane), GROUP, id="0", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def claim_stuck(self, count: int) -> list:
+        self.last_claim = time.monotonic()
+        for lane in self.lanes.order():
+            _, messages, *_ = self.redis.xautoclaim(
+                lane_stream(lane), GROUP, self.consumer,
+                min_idle_time=VISIBILITY_TIMEOUT * 1000,
+                start_id="0-0",
+                count=count
+            )
+            if not messages:
+                continue
+
+            pipe = self.redis.pipeline(transaction=False)
+            for entry_id, _ in messages:
+                pipe.xpending_range(lane_stream(lane), GROUP, min=entry_id, max=entry_id, count=1)
+            deliveries = delivery_counts(pipe.execute())
+
+            pipe = self.redis.pipeline()
+            jobs = accept(pipe, lane, messages, deliveries)
+            pipe.execute()
+            if jobs:
+                return jobs
+        return []
+
+    def read(self, count: int = 1, block_ms: int = 5000) -> list:
+        if time.monotonic() - self.last_claim >= CLAIM_INTERVAL:
+            jobs = self.claim_stuck(count)
+            if jobs:
+                return jobs
+
+        order = self.lanes.order()
+        for lane in order:
+            response = self.redis.xreadgroup(GROUP, self.consumer, {lane_stream(lane): ">"}, count=count)
+            jobs = self.accept_response(response)
+            if jobs:
+                return jobs
+
+        # every lane is empty - wait for the first job in any of them
+        response = self.redis.xreadgroup(
+            GROUP, self.consumer, {lane_stream(lane): ">" for lane in order}, count=1, block=block_ms
+        )
+        return self.accept_response(response)
+
+    def accept_response(self, response) -> list:
+        pipe = self.redis.pipeline()
+        jobs = []
+        for lane, messages in lane_messages(response):
+            jobs += accept(pipe, lane, messages, {})
+            self.lanes.served(lane)
+        pipe.execute()
+        return jobs
+
+
+class AsyncJobQueue:
+    """
+    JobQueue on a redis.asyncio client. Call create_groups() once before read().
+    """
+
+    def __init__(self, redis_client, consumer: str = None):
+        self.redis = redis_client
+        self.consumer = consumer or consumer_name()
+        self.lanes = WeightedLanes()
+        self.last_claim = 0.0
+
+    async def create_groups(self):
+        for lane in LANES:
+            try:
+                await self.redis.xgroup_create(lane_stream(lane), GROUP, id="0", mkstream=True)
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def claim_stuck(self, count: int) -> list:
+        self.last_claim = time.monotonic()
+        for lane in self.lanes.order():
+            _, messages, *_ = await self.redis.xautoclaim(
+                lane_stream(lane), GROUP, self.consumer,
+                min_idle_time=VISIBILITY_TIMEOUT * 1000,
+                start_id="0-0",
+                count=count
+            )
+            if not messages:
+                continue
+
+            pipe = self.redis.pipeline(transaction=False)
+            for entry_id, _ in messages:
+                pipe.xpending_range(lane_stream(lane), GROUP, min=entry_id, max=entry_id, count=1)
+            deliveries = delivery_counts(await pipe.execute())
+
+            pipe = self.redis.pipeline()
+            jobs = accept(pipe, lane, messages, deliveries)
+            await pipe.execute()
+            if jobs:
+                return jobs
+        return []
+
+    async def read(self, count: int = 1, block_ms: int = 5000) -> list:
+        if time.monotonic() - self.last_claim >= CLAIM_INTERVAL:
+            jobs = await self.claim_stuck(count)
+            if jobs:
+                return jobs
+
+        order = self.lanes.order()
+        for lane in order:
+            response = await self.redis.xreadgroup(GROUP, self.consumer, {lane_stream(lane): ">"}, count=count)
+            jobs = await self.accept_response(response)
+            if jobs:
+                return jobs
+
+        response = await self.redis.xreadgroup(
+            GROUP, self.consumer, {lane_stream(lane): ">" for lane in order}, count=1, block=block_ms
+        )
+        return await self.accept_response(response)
+
+    async def accept_response(self, response) -> list:
+        pipe = self.redis.pipeline()
+        jobs = []
+        for lane, messages in lane_messages(response):
+            jobs += accept(pipe, lane, messages, {})
+            self.lanes.served(lane)
+        await pipe.execute()
+        return jobs
+
+
+# ---------------------------------------------------------
+# Admission control
+# ---------------------------------------------------------
+class QueueFull(Exception):
+    def __init__(self, lane: str, wait: float, retry_after: int):
+        wait_text = "unknown" if math.isinf(wait) else f"~{wait:.0f}s"
+        super().__init__(
+            f"{lane} queue wait {wait_text} is over its {SLO_SECONDS[lane]}s target, retry after {retry_after}s"
+        )
+        self.lane = lane
+        self.wait = wait
+        self.retry_after = retry_after
+
+
+def queue_snapshot(redis_client) -> dict:
+    """
+    Unfinished jobs per lane and jobs finished per second over the last
+    DRAIN_WINDOW seconds, in one round trip.
+    """
+    now = int(time.time())
+    pipe = redis_client.pipeline(transaction=False)
+    for lane in LANES:
+        pipe.xlen(lane_stream(lane))
+    pipe.mget([drained_key(second) for second in range(now - DRAIN_WINDOW, now)])
+    *depths, drained = pipe.execute()
+
+    return {
+        "depth": dict(zip(LANES, depths)),
+        "drain_rate": sum(int(count) for count in drained if count) / DRAIN_WINDOW
+    }
+
+
+def wait_estimate(snapshot: dict, lane: str, extra: int = 0) -> float:
+    """
+    Seconds a new job in lane would wait: the jobs ahead of it divided by
+    the lane's share of the drain rate (its weight among the busy lanes).
+    """
+    depth = snapshot["depth"][lane] + extra
+    if depth == 0:
+        return 0.0
+    if not snapshot["drain_rate"]:
+        return math.inf
+
+    busy = [name for name, count in snapshot["depth"].items() if count or name == lane]
+    share = LANES[lane] / sum(LANES[name] for name in busy)
+    return depth / (snapshot["drain_rate"] * share)
+
+
+def publish_metrics(redis_client, snapshot: dict):
+    """
+    Depth, drain rate and estimated wait in rag:metrics:queue, for an
+    autoscaler to add workers when waits approach the SLO.
+    """
+    metrics = {"drain_rate": snapshot["drain_rate"], "updated_at": time.time()}
+    for lane in LANES:
+        wait = wait_estimate(snapshot, lane)
+        metrics[f"depth:{lane}"] = snapshot["depth"][lane]
+        metrics[f"wait:{lane}"] = -1 if math.isinf(wait) else round(wait, 1)
+    redis_client.hset(METRICS_KEY, mapping=metrics)
+
+
+class AdmissionControl:
+    """
+    Used by producers before enqueueing. Reads the queue snapshot at most
+    every refresh seconds (and publishes it), counting its own admitted
+    jobs in between.
+    """
+
+    def __init__(self, redis_client, refresh: float = 1.0):
+        self.redis = redis_client
+        self.refresh = refresh
+        self.snapshot = None
+        self.fetched = 0.0
+
+    def current(self) -> dict:
+        if self.snapshot is None or time.monotonic() - self.fetched >= self.refresh:
+            self.snapshot = queue_snapshot(self.redis)
+            self.fetched = time.monotonic()
+            publish_metrics(self.redis, self.snapshot)
+        return self.snapshot
+
+    def admit(self, lane: str, count: int = 1) -> str:
+        """
+        Returns the lane count new jobs should go to, or raises QueueFull
+        with a retry-after hint.
+        """
+        snapshot = self.current()
+
+        for candidate in (lane, DOWNGRADE.get(lane)):
+            if candidate is None:
+                continue
+            wait = wait_estimate(snapshot, candidate, count)
+            # nothing finished lately: let in up to COLD_START_DEPTH jobs, or any batch
+            # into an empty lane - else a batch over the cap would never get in
+            depth = snapshot["depth"][candidate]
+            cold_start = math.isinf(wait) and (depth == 0 or depth + count <= COLD_START_DEPTH)
+            if wait <= SLO_SECONDS[candidate] or cold_start:
+                snapshot["depth"][candidate] += count
+                return candidate
+
+        wait = wait_estimate(snapshot, lane, count)
+        if math.isinf(wait):
+            retry_after = DRAIN_WINDOW
+        else:
+            retry_after = max(math.ceil(wait - SLO_SECONDS[lane]), 1)
+        raise QueueFull(lane, wait, retry_after)
+
+
+# ---------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------
+def queue_metrics(redis_client) -> dict:
+    """
+    Per lane - lag: entries no worker has read yet, pending: read but not
+    acknowledged, expired: dropped past their deadline, wait: queue wait
+    histogram {bucket upper bound in ms: jobs}. Per consumer: pending over
+    all lanes and the time since it last read or acknowledged anything.
+    """
+    metrics = {"lanes": {}, "consumers": {}, "dead": redis_client.xlen(DEAD_STREAM)}
+    expired_counts = redis_client.hgetall(EXPIRED_KEY)
+
+    for lane in LANES:
+        stream = lane_stream(lane)
+        waits = redis_client.hgetall(wait_key(lane))
+        lane_metrics = {
+            "length": 0, "lag": 0, "pending": 0,
+            "expired": int(expired_counts.get(lane, 0)),
+            "wait": {bucket: int(waits.get(bucket, 0)) for bucket in [*map(str, WAIT_BUCKETS_MS), "inf"]}
+        }
+        metrics["lanes"][lane] = lane_metrics
+        if not redis_client.exists(stream):
+            continue
+
+        lane_metrics["length"] = redis_client.xlen(stream)
+        for group in redis_client.xinfo_groups(stream):
+            if group["name"] == GROUP:
+                lane_metrics["lag"] = group.get("lag")
+                lane_metrics["pending"] = group["pending"]
+
+        for consumer in redis_client.xinfo_consumers(stream, GROUP):
+            totals = metrics["consumers"].setdefault(consumer["name"], {"pending": 0, "idle_ms": consumer["idle"]})
+            totals["pending"] += consumer["pending"]
+            totals["idle_ms"] = min(totals["idle_ms"], consumer["idle"])
+
+    return metrics
+
+
+if __name__ == "__main__":
+
+    redis_client = redis.Redis(host="localhost", port=6379, decode_responses=True)
+    metrics = queue_metrics(redis_client)
+    snapshot = queue_snapshot(redis_client)
+    publish_metrics(redis_client, snapshot)
+
+    print(f"{'lane':<12} {'entries':>8} {'lag':>6} {'pending':>8} {'expired':>8} {'wait s':>8} {'slo s':>6}")
+    for lane, lane_metrics in metrics["lanes"].items():
+        lag = "n/a" if lane_metrics["lag"] is None else lane_metrics["lag"]
+        wait = wait_estimate(snapshot, lane)
+        print(f"{lane:<12} {lane_metrics['length']:>8} {lag:>6} "
+              f"{lane_metrics['pending']:>8} {lane_metrics['expired']:>8} {wait:>8.1f} {SLO_SECONDS[lane]:>6}")
+    print(f"{DEAD_STREAM}: {metrics['dead']} dead, drain rate {snapshot['drain_rate']:.2f} jobs/s")
+
+    print("\nqueue wait (jobs per bucket, upper bound in ms)")
+    print(f"{'lane':<12} " + " ".join(f"{bucket:>6}" for bucket in [*map(str, WAIT_BUCKETS_MS), "inf"]))
+    for lane, lane_metrics in metrics["lanes"].items():
+        print(f"{lane:<12} " + " ".join(f"{count:>6}" for count in lane_metrics["wait"].values()))
+
+    print(f"\n{'consumer':<32} {'pending':>8} {'idle s':>8}")
+    for name, consumer in metrics["consumers"].items():
+        print(f"{name:<32} {consumer['pending']:>8} {consumer['idle_ms'] / 1000:>8.1f}")
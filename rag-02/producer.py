@@ -1,6 +1,12 @@
+import argparse
+import json
 import redis
+import sys
+import time
 import uuid
 
+from job_queue import DEFAULT_LANE, AdmissionControl, QueueFull, enqueue
+
 
 # REDIS CONNECTION
 
@@ -10,21 +16,116 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
+# BACKPRESSURE - JOBS ARE MOVED TO A LOWER LANE OR REJECTED (QueueFull) WHEN THE QUEUE IS TOO LONG
+
+admission = AdmissionControl(redis_client)
+
 # PUSH QUERY TO THE QUEUE
 
-def enqueue_query(query: str):
-    job_id = str(uuid.uuid4())
+# priority: "interactive" | "default" | "bulk" (see job_queue.LANES)
+# timeout: seconds after which the answer is no longer wanted - the worker skips the job
 
-    payload = {
-        "job_id": job_id,
-        "query": query
+def new_job(query: str, priority: str = DEFAULT_LANE, timeout: float = None) -> dict:
+    now = time.time()
+    return {
+        "job_id": str(uuid.uuid4()),
+        "query": query,
+        "priority": priority,
+        "enqueued_at": now,
+        "deadline": now + timeout if timeout else None
     }
-    redis_client.rpush("rag:requests", str(payload))
-    return job_id
 
-user_query = input("> ")
-job = enqueue_query(user_query)
 
-print("query sent to queue")
-print(job)
+def enqueue_query(query: str, priority: str = DEFAULT_LANE, timeout: float = None):
+    # raises QueueFull (with .retry_after) when the estimated wait is over the lane's SLO
+    payload = new_job(query, admission.admit(priority), timeout)
+    enqueue(redis_client, payload)
+    return payload["job_id"]
+
+
+# BULK - ONE ROUND TRIP PER BATCH INSTEAD OF PER QUESTION
+
+def enqueue_queries(records, priority: str = "bulk", timeout: float = None, batch_size: int = 1000,
+                    wait: bool = True):
+    """
+    records: dicts with a "query" (any other fields are passed through).
+    Yields {"job_id", **record} per enqueued question, in input order.
+    A batch the queue can't take is retried after its retry-after hint
+    (wait=True) or raises QueueFull.
+    """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield from _enqueue_batch(batch, priority, timeout, wait)
+            batch = []
+    if batch:
+        yield from _enqueue_batch(batch, priority, timeout, wait)
+
+
+def _enqueue_batch(records: list, priority: str, timeout: float, wait: bool):
+    while True:
+        try:
+            lane = admission.admit(priority, len(records))
+            break
+        except QueueFull as e:
+            if not wait:
+                raise
+            print(f"{e} - waiting")
+            time.sleep(e.retry_after)
+
+    # built after admission, so enqueued_at and deadline don't include the wait above
+    payloads = [new_job(record["query"], lane, timeout) for record in records]
+
+    pipe = redis_client.pipeline(transaction=False)
+    for payload in payloads:
+        enqueue(pipe, payload)
+    pipe.execute()
+
+    for payload, record in zip(payloads, records):
+        yield {**record, "job_id": payload["job_id"]}
+
+
+def read_jsonl(path: str):
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "query" not in record:
+                raise ValueError(f"{path}:{line_number}: no \"query\" field")
+            yield record
+
+
+if __name__ == "__main__":
+
+    # python producer.py questions.jsonl --manifest manifest.jsonl  - bulk enqueue
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description="Enqueue every question of a JSONL file")
+        parser.add_argument("input", help='JSONL file, one {"query": ...} per line')
+        parser.add_argument("--manifest", default="manifest.jsonl", help="where to write the job ids")
+        parser.add_argument("--priority", default="bulk")
+        parser.add_argument("--timeout", type=float, help="seconds after which unanswered jobs are dropped")
+        parser.add_argument("--batch-size", type=int, default=1000, help="questions per round trip")
+        args = parser.parse_args()
+
+        started = time.perf_counter()
+        count = 0
+        with open(args.manifest, "w") as manifest:
+            for item in enqueue_queries(read_jsonl(args.input), args.priority, args.timeout, args.batch_size):
+                manifest.write(json.dumps(item) + "\n")
+                count += 1
+
+        print(f"{count} queries sent to queue in {time.perf_counter() - started:.1f}s, job ids in {args.manifest}")
+        sys.exit()
+
+    # python producer.py  - one question
+    user_query = input("> ")
+    try:
+        job = enqueue_query(user_query, priority="interactive", timeout=300)
+    except QueueFull as e:
+        print(f"too busy right now, try again in {e.retry_after}s")
+        sys.exit(1)
 
+    print("query sent to queue")
+    print(job)
@@ -0,0 +1,227 @@
+"""
+single_flight.py
+
+Coalesces identical questions that are in flight at the same time, so a
+popular question costs one retrieval and one LLM call instead of one per
+job.
+
+- questions are keyed by collection + normalized text (case, whitespace,
+  trailing punctuation ignored)
+- the first job takes a lease, SET rag:flight:{key} NX, and computes the
+  answer; the lease expires by itself if that worker dies
+- duplicates on any worker wait for the leader's done signal and copy its
+  answer into their own result keys; in the async worker, duplicates on
+  the same process share one wait
+- if the leader fails it drops the lease and pushes an abort signal, so
+  waiting jobs compute their own answer right away instead of waiting out
+  the lease; if its worker disappears they do so once the lease expires
+
+Saved calls are counted in the rag:metrics:coalesced hash:
+python single_flight.py
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+
+import redis
+
+from job_queue import RESULT_TTL, ack, done_key, notify_done, response_key, stream_key
+
+LEASE_SECONDS = 120 # longer than any answer takes to generate
+COUNTERS_KEY = "rag:metrics:coalesced"
+
+# compare-and-delete, so a leader whose lease already expired can't drop the next leader's
+RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"[\s?!.]+$", "", " ".join(query.casefold().split()))
+
+
+def flight_key(query: str, collection: str) -> str:
+    digest = hashlib.sha256(f"{collection}\0{normalize_query(query)}".encode()).hexdigest()
+    return f"rag:flight:{digest}"
+
+
+def aborted_key(job_id: str) -> str:
+    return f"rag:flight:aborted:{job_id}"
+
+
+def release(pipe, key: str, job_id: str, failed: bool = False):
+    """
+    Drops the lease. failed: the leader ends without an answer (it may be
+    queued again), wake up the jobs waiting for it.
+    """
+    pipe.eval(RELEASE_SCRIPT, 1, key, job_id)
+    if failed:
+        pipe.lpush(aborted_key(job_id), "failed")
+        pipe.expire(aborted_key(job_id), LEASE_SECONDS)
+
+
+def leader_signal_keys(leader_id: str) -> list:
+    return [done_key(leader_id), aborted_key(leader_id)]
+
+
+def put_back(pipe, popped: tuple, leader_id: str):
+    # put the signal back for the leader's own client and other waiters
+    signal, status = popped
+    pipe.lpush(signal, status)
+    pipe.expire(signal, RESULT_TTL if signal == done_key(leader_id) else LEASE_SECONDS)
+    pipe.get(response_key(leader_id))
+
+
+def publish_copy(pipe, job: dict, answer: str, leader_id: str, where: str):
+    """
+    Answers a duplicate job with the leader's answer, in the same shape
+    generate() writes (one delta with the whole answer, then done).
+    """
+    key = stream_key(job["job_id"])
+    pipe.xadd(key, {"type": "delta", "text": answer})
+    pipe.xadd(key, {"type": "done", "usage": "{}", "coalesced_with": leader_id})
+    pipe.expire(key, RESULT_TTL)
+    pipe.set(response_key(job["job_id"]), answer, ex=RESULT_TTL)
+    notify_done(pipe, job["job_id"])
+    ack(pipe, job)
+    pipe.hincrby(COUNTERS_KEY, f"saved_{where}", 1)
+
+
+def leader_result(popped: tuple, leader_id: str, answer: str):
+    # the answer if the leader succeeded, None to compute it ourselves
+    signal, status = popped
+    if signal != done_key(leader_id):
+        return None
+    return answer if json.loads(status)["status"] == "ok" else None
+
+
+# ---------------------------------------------------------
+# Blocking worker
+# ---------------------------------------------------------
+def acquire(redis_client, key: str, job_id: str) -> str:
+    """
+    Returns None if job_id now leads the flight, else the leading job id.
+    """
+    while True:
+        if redis_client.set(key, job_id, nx=True, ex=LEASE_SECONDS):
+            redis_client.delete(aborted_key(job_id)) # left over from an earlier attempt
+            return None
+        leader = redis_client.get(key)
+        if leader == job_id: # redelivered job that still holds its own lease
+            return None
+        if leader is not None: # else the lease expired in between, try again
+            return leader
+
+
+def wait_for_leader(redis_client, key: str, leader_id: str):
+    """
+    Blocks until the leading job is done. Returns its answer, or None if it
+    failed (abort signal) or its worker died (lease gone without a signal).
+    """
+    while True:
+        popped = redis_client.blpop(leader_signal_keys(leader_id), timeout=LEASE_SECONDS)
+        if popped is not None:
+            pipe = redis_client.pipeline()
+            put_back(pipe, popped, leader_id)
+            answer = pipe.execute()[-1]
+            return leader_result(popped, leader_id, answer)
+
+        if redis_client.get(key) != leader_id:
+            return None
+
+
+# ---------------------------------------------------------
+# Async worker
+# ---------------------------------------------------------
+async def aacquire(redis_client, key: str, job_id: str) -> str:
+    while True:
+        if await redis_client.set(key, job_id, nx=True, ex=LEASE_SECONDS):
+            await redis_client.delete(aborted_key(job_id))
+            return None
+        leader = await redis_client.get(key)
+        if leader == job_id:
+            return None
+        if leader is not None:
+            return leader
+
+
+async def await_leader(redis_client, key: str, leader_id: str):
+    while True:
+        popped = await redis_client.blpop(leader_signal_keys(leader_id), timeout=LEASE_SECONDS)
+        if popped is not None:
+            pipe = redis_client.pipeline()
+            put_back(pipe, popped, leader_id)
+            answer = (await pipe.execute())[-1]
+            return leader_result(popped, leader_id, answer)
+
+        if await redis_client.get(key) != leader_id:
+            return None
+
+
+class AsyncSingleFlight:
+    """
+    Per-process view of the flights: one Future per flight led by this
+    worker, one shared wait per flight led by another worker.
+    """
+
+    def __init__(self, redis_client, collection: str):
+        self.redis = redis_client
+        self.collection = collection
+        self.flights = {} # key -> (awaitable answer, leader job id, "local" | "remote")
+
+    async def join(self, job: dict):
+        """
+        Returns None if the job leads its flight (call finish() when done),
+        else (awaitable answer, leader job id, "local" | "remote").
+        """
+        key = flight_key(job["query"], self.collection)
+        if key in self.flights:
+            return self.flights[key]
+
+        leader = await aacquire(self.redis, key, job["job_id"])
+        if key in self.flights: # another job of this process got there first meanwhile
+            if leader is None:
+                pipe = self.redis.pipeline()
+                release(pipe, key, job["job_id"])
+                await pipe.execute()
+            return self.flights[key]
+
+        if leader is None:
+            job["flight"] = key
+            self.flights[key] = (asyncio.get_running_loop().create_future(), job["job_id"], "local")
+            return None
+
+        task = asyncio.create_task(await_leader(self.redis, key, leader))
+        task.add_done_callback(lambda _: self.flights.pop(key, None))
+        self.flights[key] = (task, leader, "remote")
+        return self.flights[key]
+
+    async def finish(self, job: dict, answer: str = None):
+        """
+        Called by the leading job with its answer, or None if it failed or
+        expired.
+        """
+        key = job.pop("flight", None)
+        if key is None:
+            return
+        waiting, _, _ = self.flights.pop(key)
+        waiting.set_result(answer)
+
+        pipe = self.redis.pipeline()
+        release(pipe, key, job["job_id"], failed=answer is None)
+        await pipe.execute()
+
+
+if __name__ == "__main__":
+
+    redis_client = redis.Redis(host="localhost", port=6379, decode_responses=True)
+    counters = redis_client.hgetall(COUNTERS_KEY)
+
+    local, remote = int(counters.get("saved_local", 0)), int(counters.get("saved_remote", 0))
+    print(f"retrieval + LLM calls saved: {local + remote} "
+          f"({local} duplicates on the leader's worker, {remote} on other workers)")
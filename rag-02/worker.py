@@ -1,9 +1,26 @@
+import sys
+from pathlib import Path
+
 from langchain_openai import OpenAIEmbeddings
-from langchain_qdrant import QdrantVectorStore
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import redis
-import ast
+import redis.asyncio as aioredis
+import argparse
+import asyncio
+import signal
+import time
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "common"))
+from embedding_cache import CachedEmbeddings
+from context import pack_context
+from retrieval import COLLECTION_NAME, connect_vector_db, search_params
+
+from job_queue import (
+    AsyncJobQueue, JobQueue, RESULT_TTL, ack, drop_expired, expired, notify_done, response_key,
+    retry_or_dead_letter, stream_key
+)
+from single_flight import AsyncSingleFlight, acquire, flight_key, publish_copy, release, wait_for_leader
 
 
 # ENVIRONMENT SETUP
@@ -18,44 +35,19 @@ redis_client = redis.Redis(
     decode_responses=True
 )
 
-# EMBEDDING MODEL - SAME AS OF THE VECTOR DB
-
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-large")
-
-# CONNECT TO YOUR VECTOR DB
-
-vector_db = QdrantVectorStore.from_existing_collection(
-    embedding=embeddings,
-    collection_name="ansible_vectors",
-    url="http://localhost:6333",
-)
-
-print("Worker started. Waiting for jobs to process.")
+# EMBEDDING MODEL - SAME AS OF THE VECTOR DB (CACHED LOCALLY, REPEATED QUERIES COST NOTHING)
 
-while True:
-    queue_name, raw_payload = redis_client.blpop("rag:requests")
+embeddings = CachedEmbeddings(OpenAIEmbeddings(
+    model="text-embedding-3-large"))
 
-    payload = ast.literal_eval(raw_payload)
-    job_id = payload["job_id"]
-    query = payload["query"]
+# CONNECT TO YOUR VECTOR DB (SINGLE- OR TWO-STAGE, SEE common/retrieval.py)
 
-    print(f"Processing Job: {job_id}")
-
-    # semantic search in the vector db
-    search_results = vector_db.similarity_search(query=query)
-    context = []
-
-    for item in search_results:
-        block = f"""
-    Page Content: {item.page_content}
-    Page Number: {item.metadata.get("page","NA")}
-    """
-        context.append(block.strip())
+vector_db = connect_vector_db(embeddings)
 
-    final_context = "----\n\n".join(context)
+# SYSTEM PROMPT
 
-    SYSTEM_PROMPT = f"""
+def build_system_prompt(final_context: str) -> str:
+    return f"""
 You are a RAG AI Assistant Chatbot.
 You have been given extracted content from a PDF document:
 The extracted content contains the following:
@@ -77,18 +69,398 @@ Context:
 {final_context}
 """
 
-    response = client.responses.create(
+
+# GENERATE AND STREAM EVERY DELTA INTO rag:stream:{job_id}
+# entries: {"type": "delta", "text"} ... then {"type": "done", "usage"} or {"type": "error", "error"}
+
+def generate(job: dict, final_context: str) -> str:
+    job_id = job["job_id"]
+    key = stream_key(job_id)
+    parts = []
+    usage = None
+
+    stream = client.responses.create(
+        model="gpt-5-nano",
+        instructions=build_system_prompt(final_context),
+        input=job["query"],
+        stream=True
+    )
+
+    for event in stream:
+        if event.type == "response.output_text.delta":
+            redis_client.xadd(key, {"type": "delta", "text": event.delta})
+            if not parts:
+                redis_client.expire(key, RESULT_TTL)
+            parts.append(event.delta)
+        elif event.type == "response.completed":
+            usage = event.response.usage
+
+    answer = "".join(parts)
+
+    pipe = redis_client.pipeline()
+    pipe.xadd(key, {"type": "done", "usage": usage.model_dump_json() if usage else "{}"})
+    pipe.expire(key, RESULT_TTL)
+    pipe.set(response_key(job_id), answer, ex=RESULT_TTL) # full answer for non-streaming readers
+    notify_done(pipe, job_id)
+    ack(pipe, job) # the job leaves the queue together with its answer
+    pipe.execute()
+
+    return answer
+
+
+def process_job(job: dict) -> bool:
+    # the same question already being answered (on any worker) - wait and reuse its answer
+    key = flight_key(job["query"], COLLECTION_NAME)
+    leader = acquire(redis_client, key, job["job_id"])
+    if leader is not None:
+        answer = wait_for_leader(redis_client, key, leader)
+        if answer is not None:
+            pipe = redis_client.pipeline()
+            publish_copy(pipe, job, answer, leader, "remote")
+            pipe.execute()
+            return True
+        # the leader failed - answer it ourselves
+
+    answer = None
+    try:
+        # semantic search in the vector db
+        search_results = vector_db.similarity_search(query=job["query"], search_params=search_params())
+
+        # the deadline may have passed while searching - skip the expensive part
+        if expired(job):
+            pipe = redis_client.pipeline()
+            drop_expired(pipe, job)
+            pipe.execute()
+            return False
+
+        # merge overlapping chunks, drop duplicates, stay within the token budget
+        final_context = pack_context(search_results)
+
+        answer = generate(job, final_context)
+        return True
+    finally:
+        if leader is None:
+            # without an answer (raised or expired) the waiting jobs are woken up to answer it themselves
+            pipe = redis_client.pipeline()
+            release(pipe, key, job["job_id"], failed=answer is None)
+            pipe.execute()
+
+
+# ---------------------------------------------------------
+# ASYNC MODE - N JOBS IN FLIGHT IN ONE PROCESS (--async --concurrency N)
+# same keys and stream entries as the blocking loop below
+# ---------------------------------------------------------
+
+class StageTimings:
+    """
+    Per-stage wall time of the async worker, printed every REPORT_INTERVAL
+    seconds so a slow stage (vector DB, model, Redis) is easy to spot.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.jobs = 0
+        self.failed = 0
+        self.batches = 0
+        self.expired = 0 # past their deadline after retrieval
+        self.coalesced = 0 # answered with another job's answer
+        self.totals = {"retrieve": 0.0, "generate": 0.0, "publish": 0.0}
+
+    def add(self, stage: str, seconds: float):
+        self.totals[stage] += seconds
+
+    def report(self, in_flight: int) -> str:
+        elapsed = time.perf_counter() - self.started
+        done = max(self.jobs, 1)
+        stages = ", ".join(f"{stage} {total / done * 1000:.0f} ms" for stage, total in self.totals.items())
+        return (
+            f"{self.jobs} jobs ({self.failed} failed, {self.expired} expired, {self.coalesced} coalesced), {self.jobs / elapsed:.1f} jobs/s, "
+            f"{self.jobs / max(self.batches, 1):.1f} jobs/batch, {in_flight} in flight, avg {stages}"
+        )
+
+
+REPORT_INTERVAL = 10 # seconds
+
+
+class Slots:
+    """
+    asyncio.Semaphore that also tells how many slots are free
+    (the semaphore itself has no public counter).
+    """
+
+    def __init__(self, count: int):
+        self.semaphore = asyncio.Semaphore(count)
+        self.free = count
+
+    async def acquire(self):
+        await self.semaphore.acquire()
+        self.free -= 1
+
+    def release(self):
+        self.free += 1
+        self.semaphore.release()
+
+
+async def agenerate(aclient, aredis, job: dict, final_context: str, timings: StageTimings) -> tuple:
+    """
+    Streams the answer like generate(). Returns the answer and the seconds
+    spent writing to Redis.
+    """
+    job_id = job["job_id"]
+    key = stream_key(job_id)
+    parts = []
+    usage = None
+    publish = 0.0
+
+    stream = await aclient.responses.create(
         model="gpt-5-nano",
-        instructions=SYSTEM_PROMPT, 
-        input=query
+        instructions=build_system_prompt(final_context),
+        input=job["query"],
+        stream=True
     )
 
-    answer = response.output_text
+    async for event in stream:
+        if event.type == "response.output_text.delta":
+            started = time.perf_counter()
+            await aredis.xadd(key, {"type": "delta", "text": event.delta})
+            if not parts:
+                await aredis.expire(key, RESULT_TTL)
+            publish += time.perf_counter() - started
+            parts.append(event.delta)
+        elif event.type == "response.completed":
+            usage = event.response.usage
+
+    answer = "".join(parts)
+
+    started = time.perf_counter()
+    pipe = aredis.pipeline()
+    pipe.xadd(key, {"type": "done", "usage": usage.model_dump_json() if usage else "{}"})
+    pipe.expire(key, RESULT_TTL)
+    pipe.set(response_key(job_id), answer, ex=RESULT_TTL)
+    notify_done(pipe, job_id)
+    ack(pipe, job)
+    await pipe.execute()
+    publish += time.perf_counter() - started
+
+    timings.add("publish", publish)
+    return answer, publish
+
+
+async def afail_job(aredis, job: dict, error: Exception, timings: StageTimings):
+    pipe = aredis.pipeline()
+    retried = retry_or_dead_letter(pipe, job, str(error))
+    await pipe.execute()
+    timings.failed += 1
+    print(f"Job {job['job_id']} failed (attempt {job['deliveries']}): {error}"
+          + (", queued again" if retried else ", giving up"))
+
+
+async def aanswer_job(aclient, aredis, flights: AsyncSingleFlight, job: dict, search_results: list,
+                      timings: StageTimings):
+    answer = None
+    try:
+        if expired(job):
+            pipe = aredis.pipeline()
+            drop_expired(pipe, job)
+            await pipe.execute()
+            timings.expired += 1
+            return
+
+        # merge overlapping chunks, drop duplicates, stay within the token budget
+        final_context = pack_context(search_results)
+
+        started = time.perf_counter()
+        answer, publish = await agenerate(aclient, aredis, job, final_context, timings)
+        # generation time without the Redis writes done while streaming
+        timings.add("generate", time.perf_counter() - started - publish)
+    except Exception as e:
+        await afail_job(aredis, job, e, timings)
+    finally:
+        timings.jobs += 1
+        # hand the answer (or None on failure) to the duplicates waiting for it
+        await flights.finish(job, answer)
+
+
+async def afollow(aclient, aredis, flights: AsyncSingleFlight, job: dict, flight: tuple, timings: StageTimings):
+    waiting, leader_id, where = flight
+    try:
+        answer = await waiting
+    except Exception:
+        answer = None
+
+    if answer is not None:
+        pipe = aredis.pipeline()
+        publish_copy(pipe, job, answer, leader_id, where)
+        await pipe.execute()
+        timings.coalesced += 1
+        timings.jobs += 1
+        return
+
+    # the leader failed - answer it ourselves
+    try:
+        search_results = await vector_db.asimilarity_search(job["query"], search_params=search_params())
+    except Exception as e:
+        await afail_job(aredis, job, e, timings)
+        timings.jobs += 1
+        return
+    await aanswer_job(aclient, aredis, flights, job, search_results, timings)
+
+
+async def arun_batch(aclient, aredis, flights: AsyncSingleFlight, jobs: list, slots: Slots,
+                     timings: StageTimings):
+    """
+    jobs: taken off the queue together. Questions already being answered
+    wait for that answer; the others are embedded in one request and
+    searched in one query_batch_points call, then every job streams its
+    own answer.
+    """
+    try:
+        leaders, followers = [], []
+        for job in jobs:
+            flight = await flights.join(job)
+            if flight is None:
+                leaders.append(job)
+            else:
+                followers.append((job, flight))
+
+        following = [afollow(aclient, aredis, flights, job, flight, timings) for job, flight in followers]
+        if not leaders:
+            await asyncio.gather(*following)
+            return
+
+        started = time.perf_counter()
+        try:
+            results = await vector_db.asimilarity_search_batch(
+                [job["query"] for job in leaders], search_params=search_params()
+            )
+        except Exception as e:
+            for job in leaders:
+                await afail_job(aredis, job, e, timings)
+                await flights.finish(job)
+            timings.jobs += len(leaders)
+            await asyncio.gather(*following)
+            return
+
+        # every job in the batch waited for the whole retrieval
+        timings.add("retrieve", (time.perf_counter() - started) * len(leaders))
+        timings.batches += 1
 
-    redis_client.set(
-        f"rag:response:{job_id}",
-        answer,
-        ex=3600
+        await asyncio.gather(
+            *(
+                aanswer_job(aclient, aredis, flights, job, search_results, timings)
+                for job, search_results in zip(leaders, results)
+            ),
+            *following
+        )
+    finally:
+        for _ in jobs:
+            slots.release()
+
+
+async def take_batch(queue: AsyncJobQueue, slots: Slots, batch_size: int, linger_ms: float) -> list:
+    """
+    Blocks up to a second for jobs, then waits up to linger_ms for more if
+    the batch is not full yet. Never takes more jobs than there are free
+    slots; the caller holds one, the others are acquired here.
+    """
+    # wake up regularly to check for shutdown
+    batch = await queue.read(count=min(batch_size, slots.free + 1), block_ms=1000)
+
+    if batch and len(batch) < batch_size and linger_ms >= 1:
+        free = min(batch_size - len(batch), slots.free - (len(batch) - 1))
+        if free > 0:
+            batch += await queue.read(count=free, block_ms=int(linger_ms))
+
+    for _ in batch[1:]:
+        await slots.acquire() # free slots were checked above, only waits if several lanes answered at once
+    return batch
+
+
+async def run_async(concurrency: int, batch_size: int = 1, linger_ms: float = 0):
+    aclient = AsyncOpenAI()
+    aredis = aioredis.Redis(host="localhost", port=6379, decode_responses=True)
+    queue = AsyncJobQueue(aredis)
+    await queue.create_groups()
+    flights = AsyncSingleFlight(aredis, COLLECTION_NAME)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    slots = Slots(concurrency)
+    in_flight = set()
+    timings = StageTimings()
+    last_report = time.perf_counter()
+
+    print(
+        f"Async worker started, up to {concurrency} jobs in flight, "
+        f"batches of up to {batch_size} ({linger_ms:g} ms linger). Waiting for jobs to process."
     )
 
-    print(f"Job {job_id} completed.")
+    while not stop.is_set():
+        # only read jobs when there is a free slot for them,
+        # so unstarted jobs stay in the stream for other workers
+        await slots.acquire()
+        if stop.is_set():
+            slots.release()
+            break
+
+        jobs = await take_batch(queue, slots, batch_size, linger_ms)
+        if not jobs:
+            slots.release()
+        else:
+            task = asyncio.create_task(arun_batch(aclient, aredis, flights, jobs, slots, timings))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if time.perf_counter() - last_report >= REPORT_INTERVAL:
+            print(timings.report(concurrency - slots.free))
+            last_report = time.perf_counter()
+
+    print(f"Shutting down, draining {concurrency - slots.free} jobs in flight...")
+    await asyncio.gather(*in_flight, return_exceptions=True)
+    print(timings.report(0))
+
+    await aredis.aclose()
+    await aclient.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="RAG worker: takes jobs from rag:jobs and streams the answers back")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="process several jobs concurrently with asyncio")
+    parser.add_argument("--concurrency", type=int, default=32, help="jobs in flight with --async")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="jobs whose questions are embedded and searched together with --async")
+    parser.add_argument("--linger-ms", type=float, default=5,
+                        help="how long to wait for more jobs before retrieving a batch that is not full")
+    args = parser.parse_args()
+
+    if args.use_async:
+        asyncio.run(run_async(args.concurrency, max(args.batch_size, 1), args.linger_ms))
+        sys.exit(0)
+
+    queue = JobQueue(redis_client)
+    print(f"Worker {queue.consumer} started. Waiting for jobs to process.")
+
+    while True:
+        for job in queue.read():
+            job_id = job["job_id"]
+            print(f"Processing Job: {job_id}")
+
+            try:
+                if not process_job(job):
+                    print(f"Job {job_id} expired before generation.")
+                    continue
+            except Exception as e:
+                # queued again for another attempt, dead-lettered after MAX_DELIVERIES
+                pipe = redis_client.pipeline()
+                retried = retry_or_dead_letter(pipe, job, str(e))
+                pipe.execute()
+                print(f"Job {job_id} failed (attempt {job['deliveries']}): {e}"
+                      + (", queued again" if retried else ", giving up"))
+                continue
+
+            print(f"Job {job_id} completed.")